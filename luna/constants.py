@@ -5,4 +5,5 @@ class Constants:
     EXPORT_DIRECTORY = "export/"
     IMPORT_DIRECTORY = "import/"
     LEGACY_IMPORT_DIRECTORY = "update/"
+    SCENE_CACHE_DIRECTORY = "cache/"
     CHARS_PER_LINE = 55
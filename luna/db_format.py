@@ -0,0 +1,390 @@
+import array
+import json
+import os
+import struct
+import sys
+
+from luna.sqlite_store import SqliteStore
+
+
+class SerializedDbFormat:
+    """
+    Base for formats that serialize the entire DB to a single blob.
+    """
+
+    @classmethod
+    def load_file(cls, db_cls, path):
+        with open(path, 'rb') as input_file:
+            return cls.loads(db_cls, input_file.read())
+
+    @classmethod
+    def save_file(cls, db, path):
+        # Write the new snapshot alongside the old one and swap it in, so
+        # that a crash never leaves a partially written DB behind
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb+') as output:
+            output.write(cls.dumps(db))
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(temp_path, path)
+
+
+class JsonDbFormat(SerializedDbFormat):
+    """
+    The original, human-readable translation DB format.
+    """
+
+    NAME = 'json'
+
+    @staticmethod
+    def detect(raw):
+        return raw[:1] == b'{'
+
+    @staticmethod
+    def dumps(db):
+        return db.as_json().encode('utf-8')
+
+    @staticmethod
+    def loads(db_cls, raw):
+        return db_cls.from_json(json.loads(raw))
+
+
+class BinaryDbFormat(SerializedDbFormat):
+    """
+    Compact, versioned binary translation DB format.
+    All strings (hashes, text, comments, scene names, modifiers) are stored
+    once in a single string pool, and everything else refers to them by
+    index. The scene map is stored column-wise, with one array per
+    TextCommand attribute across all scenes.
+
+    Layout, all integers little-endian:
+        magic (7 bytes) + version (u8)
+        string pool:  count, byte offsets[count + 1], UTF-8 data
+        scenes:       count, name[count], command count[count]
+        commands:     offset[n], page number[n] (signed), flags[n] (u8),
+                      jp hash[n], modifier count[n], modifiers[sum]
+        lines:        count, jp hash[count], jp text[count], en text[count],
+                      comment[count]
+        overrides:    count, offset[count], jp text[count], en text[count],
+                      comment[count]
+        charswap map: count, key[count], value[count]
+    Unless noted otherwise, values are u32. Absent strings are stored as
+    NONE_INDEX.
+    """
+
+    NAME = 'binary'
+    MAGIC = b'LUNADB\0'
+    VERSION = 1
+
+    NONE_INDEX = 0xFFFFFFFF
+
+    # TextCommand flag bits
+    FLAG_HAS_RUBY = 1 << 0
+    FLAG_IS_GLUED = 1 << 1
+    FLAG_IS_CHOICE = 1 << 2
+    FLAG_HAS_FORCED_NEWLINE = 1 << 3
+
+    @classmethod
+    def detect(cls, raw):
+        return raw[:len(cls.MAGIC)] == cls.MAGIC
+
+    @classmethod
+    def dumps(cls, db):
+        (scene_map, line_by_hash, overrides_by_offset, charswap_map) = \
+            db.contents()
+
+        # Pool every string we come across
+        pool_index = {}
+        pool = []
+
+        def intern(string):
+            if string is None:
+                return cls.NONE_INDEX
+            index = pool_index.get(string)
+            if index is None:
+                index = len(pool)
+                pool_index[string] = index
+                pool.append(string.encode('utf-8'))
+            return index
+
+        # Scene map columns
+        scene_names = []
+        scene_lengths = []
+        offsets = []
+        page_numbers = []
+        flags = []
+        hashes = []
+        modifier_counts = []
+        modifiers = []
+        for scene_name, commands in scene_map.items():
+            scene_names.append(intern(scene_name))
+            scene_lengths.append(len(commands))
+            for cmd in commands:
+                offsets.append(cmd.offset)
+                page_numbers.append(cmd.page_number)
+                flags.append(
+                    (cls.FLAG_HAS_RUBY if cmd.has_ruby else 0) |
+                    (cls.FLAG_IS_GLUED if cmd.is_glued else 0) |
+                    (cls.FLAG_IS_CHOICE if cmd.is_choice else 0) |
+                    (cls.FLAG_HAS_FORCED_NEWLINE
+                     if cmd.has_forced_newline else 0)
+                )
+                hashes.append(intern(cmd.jp_hash))
+                modifier_counts.append(len(cmd.modifiers))
+                modifiers.extend(intern(m) for m in cmd.modifiers)
+
+        # Content-addressed lines
+        line_columns = ([], [], [], [])
+        for jp_hash, line in line_by_hash.items():
+            for column, value in zip(line_columns, (
+                    jp_hash, line.jp_text, line.en_text, line.comment)):
+                column.append(intern(value))
+
+        # Overrides
+        override_offsets = []
+        override_columns = ([], [], [])
+        for offset, line in overrides_by_offset.items():
+            override_offsets.append(offset)
+            for column, value in zip(override_columns, (
+                    line.jp_text, line.en_text, line.comment)):
+                column.append(intern(value))
+
+        # Charswap map
+        charswap_keys = [intern(k) for k in charswap_map.keys()]
+        charswap_values = [intern(v) for v in charswap_map.values()]
+
+        # Pool offsets
+        pool_offsets = [0]
+        for data in pool:
+            pool_offsets.append(pool_offsets[-1] + len(data))
+
+        return b''.join([
+            cls.MAGIC, struct.pack("<B", cls.VERSION),
+            cls._pack_count(pool), cls._pack_array('I', pool_offsets),
+            *pool,
+            cls._pack_count(scene_names),
+            cls._pack_array('I', scene_names),
+            cls._pack_array('I', scene_lengths),
+            cls._pack_array('I', offsets),
+            cls._pack_array('i', page_numbers),
+            cls._pack_array('B', flags),
+            cls._pack_array('I', hashes),
+            cls._pack_array('I', modifier_counts),
+            cls._pack_array('I', modifiers),
+            cls._pack_count(line_columns[0]),
+            *[cls._pack_array('I', column) for column in line_columns],
+            cls._pack_count(override_offsets),
+            cls._pack_array('I', override_offsets),
+            *[cls._pack_array('I', column) for column in override_columns],
+            cls._pack_count(charswap_keys),
+            cls._pack_array('I', charswap_keys),
+            cls._pack_array('I', charswap_values),
+        ])
+
+    @classmethod
+    def loads(cls, db_cls, raw):
+        assert cls.detect(raw), "Not a binary translation DB"
+        reader = cls._Reader(raw, len(cls.MAGIC))
+        (version,) = struct.unpack("<B", reader.read(1))
+        assert version == cls.VERSION, \
+            f"Unsupported binary DB version {version}"
+
+        # String pool
+        pool_count = reader.count()
+        pool_offsets = reader.array('I', pool_count + 1)
+        pool_data = bytes(reader.read(pool_offsets[-1]))
+        pool = [
+            pool_data[pool_offsets[i]:pool_offsets[i + 1]].decode('utf-8')
+            for i in range(pool_count)
+        ]
+
+        def string(index):
+            return None if index == cls.NONE_INDEX else pool[index]
+
+        # Scene map
+        scene_count = reader.count()
+        scene_names = reader.array('I', scene_count)
+        scene_lengths = reader.array('I', scene_count)
+        command_count = sum(scene_lengths)
+        offsets = reader.array('I', command_count)
+        page_numbers = reader.array('i', command_count)
+        flags = reader.array('B', command_count)
+        hashes = reader.array('I', command_count)
+        modifier_counts = reader.array('I', command_count)
+        modifiers = reader.array('I', sum(modifier_counts))
+
+        scene_map = {}
+        cmd_index = 0
+        modifier_index = 0
+        for name, length in zip(scene_names, scene_lengths):
+            commands = []
+            for i in range(cmd_index, cmd_index + length):
+                cmd_modifiers = [
+                    pool[m] for m in modifiers[
+                        modifier_index:modifier_index + modifier_counts[i]]
+                ]
+                modifier_index += modifier_counts[i]
+                commands.append(db_cls.TextCommand(
+                    offsets[i],
+                    pool[hashes[i]],
+                    page_numbers[i],
+                    has_ruby=bool(flags[i] & cls.FLAG_HAS_RUBY),
+                    is_glued=bool(flags[i] & cls.FLAG_IS_GLUED),
+                    is_choice=bool(flags[i] & cls.FLAG_IS_CHOICE),
+                    modifiers=cmd_modifiers,
+                    has_forced_newline=bool(
+                        flags[i] & cls.FLAG_HAS_FORCED_NEWLINE),
+                ))
+            cmd_index += length
+            scene_map[pool[name]] = commands
+
+        # Content-addressed lines
+        line_count = reader.count()
+        (keys, jp_texts, en_texts, comments) = [
+            reader.array('I', line_count) for _ in range(4)]
+        line_by_hash = {
+            pool[key]: db_cls.TLLine(
+                string(jp_text), string(en_text), string(comment))
+            for key, jp_text, en_text, comment
+            in zip(keys, jp_texts, en_texts, comments)
+        }
+
+        # Overrides
+        override_count = reader.count()
+        override_offsets = reader.array('I', override_count)
+        (jp_texts, en_texts, comments) = [
+            reader.array('I', override_count) for _ in range(3)]
+        overrides_by_offset = {
+            offset: db_cls.TLLine(
+                string(jp_text), string(en_text), string(comment))
+            for offset, jp_text, en_text, comment
+            in zip(override_offsets, jp_texts, en_texts, comments)
+        }
+
+        # Charswap map
+        charswap_count = reader.count()
+        charswap_keys = reader.array('I', charswap_count)
+        charswap_values = reader.array('I', charswap_count)
+        charswap_map = {
+            pool[k]: pool[v] for k, v in zip(charswap_keys, charswap_values)
+        }
+
+        return db_cls(
+            scene_map, line_by_hash, overrides_by_offset, charswap_map)
+
+    @staticmethod
+    def _pack_count(values):
+        return struct.pack("<I", len(values))
+
+    @staticmethod
+    def _pack_array(typecode, values):
+        packed = array.array(typecode, values)
+        if sys.byteorder != 'little':
+            packed.byteswap()
+        return packed.tobytes()
+
+    class _Reader:
+        def __init__(self, raw, offset):
+            self._raw = memoryview(raw)
+            self._offset = offset
+
+        def read(self, size):
+            data = self._raw[self._offset:self._offset + size]
+            assert len(data) == size, "Truncated binary DB"
+            self._offset += size
+            return data
+
+        def count(self):
+            (count,) = struct.unpack("<I", self.read(4))
+            return count
+
+        def array(self, typecode, count):
+            values = array.array(typecode)
+            values.frombytes(self.read(count * values.itemsize))
+            if sys.byteorder != 'little':
+                values.byteswap()
+            return values
+
+
+class SqliteDbFormat:
+    """
+    Translation DB kept in an SQLite database, see SqliteStore.
+    DBs loaded from this format stay attached to the database and write each
+    edit straight through to it, so saving them back is close to free.
+    """
+
+    NAME = 'sqlite'
+
+    @staticmethod
+    def detect(raw):
+        return raw[:len(SqliteStore.MAGIC)] == SqliteStore.MAGIC
+
+    @staticmethod
+    def load_file(db_cls, path):
+        store = SqliteStore(path)
+        return db_cls(
+            store.scene_map(db_cls.TextCommand),
+            store.line_map(db_cls.TLLine),
+            store.override_map(db_cls.TLLine),
+            store.charswap_map(),
+            store=store
+        )
+
+    @staticmethod
+    def save_file(db, path):
+        # Edits to a DB opened from this file have already been written
+        store = db.store()
+        if isinstance(store, SqliteStore) and store.covers(path):
+            return
+
+        # Rewrite an existing database in place, as other tools may have it
+        # open. Anything else at path can simply be replaced.
+        is_sqlite = False
+        if os.path.exists(path):
+            with open(path, 'rb') as db_file:
+                is_sqlite = SqliteDbFormat.detect(
+                    db_file.read(len(SqliteStore.MAGIC)))
+        if not is_sqlite:
+            SqliteStore.create(path, db.contents()).close()
+            return
+
+        target = SqliteStore(path)
+        try:
+            target.replace_contents(*db.contents())
+        finally:
+            target.close()
+
+
+class DbFormats:
+    """
+    Registry of the available translation DB formats.
+    """
+
+    # Longest header needed to tell the formats apart
+    HEADER_SIZE = 16
+
+    ALL = [JsonDbFormat, BinaryDbFormat, SqliteDbFormat]
+    DEFAULT = JsonDbFormat
+
+    @classmethod
+    def names(cls):
+        return [db_format.NAME for db_format in cls.ALL]
+
+    @classmethod
+    def by_name(cls, name):
+        for db_format in cls.ALL:
+            if db_format.NAME == name:
+                return db_format
+        raise ValueError(f"Unknown DB format '{name}'")
+
+    @classmethod
+    def detect(cls, raw):
+        for db_format in cls.ALL:
+            if db_format.detect(raw):
+                return db_format
+        return cls.DEFAULT
+
+    @classmethod
+    def detect_file(cls, path):
+        with open(path, 'rb') as input_file:
+            return cls.detect(input_file.read(cls.HEADER_SIZE))
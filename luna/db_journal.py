@@ -0,0 +1,166 @@
+import contextlib
+import json
+import os
+
+
+class DbJournal:
+    """
+    Append-only journal of edits made to a translation DB snapshot.
+    Each edit is appended as one JSON record per line and fsynced before
+    the edit returns, so a crash never loses more than the edit in flight.
+    Loading the snapshot replays the journal on top of it, and writing a
+    fresh snapshot folds the journal back in (compaction) and empties it.
+    Replaying an edit more than once is harmless, so a crash between
+    writing a snapshot and emptying the journal is also safe.
+    """
+
+    SUFFIX = '.journal'
+
+    # Journal size above which save() compacts it into a new snapshot
+    COMPACT_THRESHOLD_BYTES = 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._pending = None
+
+    @classmethod
+    def path_for(cls, db_path):
+        return db_path + cls.SUFFIX
+
+    @classmethod
+    def truncate_for(cls, db_path):
+        # Empty the journal for a DB snapshot that has just been rewritten.
+        # Truncating rather than unlinking keeps any open journal usable,
+        # since appends always go to the current end of file.
+        try:
+            with open(cls.path_for(db_path), 'r+b') as journal_file:
+                journal_file.truncate(0)
+                os.fsync(journal_file.fileno())
+        except FileNotFoundError:
+            pass
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def covers(self, db_path):
+        # Whether the snapshot at db_path plus this journal already hold
+        # every edit, with the journal still small enough to keep
+        return self.path == self.path_for(db_path) and \
+            self.size() < self.COMPACT_THRESHOLD_BYTES
+
+    def replay(self, db):
+        # Apply every journalled edit to db. This must happen before the
+        # journal is attached to the DB, or the edits are journalled again.
+        try:
+            with open(self.path, 'rb') as journal_file:
+                raw_records = journal_file.read().split(b'\n')
+        except FileNotFoundError:
+            return 0
+
+        replayed = 0
+        for raw_record in raw_records:
+            if not raw_record.strip():
+                continue
+
+            try:
+                record = json.loads(raw_record)
+            except ValueError:
+                # A record torn by a crash. Appends always start on a fresh
+                # line, so any records after it are still good.
+                print(f"Ignoring damaged journal record in {self.path}")
+                continue
+
+            self._apply(db, record)
+            replayed += 1
+
+        return replayed
+
+    @staticmethod
+    def _apply(db, record):
+        op = record['op']
+        if op == 'line':
+            try:
+                db.set_translation_and_comment_for_hash(
+                    record['jp_hash'], record['en_text'], record['comment'])
+            except KeyError:
+                print(f"Unknown hash {record['jp_hash']}")
+        elif op == 'override':
+            db.override_translation_and_comment_for_offset(
+                record['offset'], record['en_text'], record['comment'])
+        elif op == 'clear_overrides':
+            db.clear_offset_overrides()
+        elif op == 'charswap':
+            db.set_charswap_map(record['map'])
+        else:
+            raise ValueError(f"Unknown journal op '{op}'")
+
+    def _append(self, record):
+        line = json.dumps(record).encode('utf-8') + b'\n'
+        if self._pending is not None:
+            self._pending.append(line)
+            return
+
+        self._write([line])
+
+    def _write(self, lines):
+        if not lines:
+            return
+
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+
+            # If the last record was torn by a crash, start a fresh line so
+            # that it doesn't swallow the next one
+            if self._file.tell() > 0:
+                with open(self.path, 'rb') as journal_file:
+                    journal_file.seek(-1, os.SEEK_END)
+                    if journal_file.read(1) != b'\n':
+                        lines = [b'\n'] + lines
+        self._file.write(b''.join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    @contextlib.contextmanager
+    def batch(self):
+        # Write all records from the batch with a single fsync at the end
+        if self._pending is not None:
+            yield
+            return
+
+        self._pending = []
+        try:
+            yield
+        finally:
+            (lines, self._pending) = (self._pending, None)
+            self._write(lines)
+
+    def put_line(self, jp_hash, line):
+        self._append({
+            'op': 'line',
+            'jp_hash': jp_hash,
+            'en_text': line.en_text,
+            'comment': line.comment,
+        })
+
+    def put_override(self, offset, line):
+        self._append({
+            'op': 'override',
+            'offset': offset,
+            'en_text': line.en_text,
+            'comment': line.comment,
+        })
+
+    def clear_overrides(self):
+        self._append({'op': 'clear_overrides'})
+
+    def put_charswap_map(self, swap_map):
+        self._append({'op': 'charswap', 'map': swap_map})
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
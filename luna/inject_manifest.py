@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+from luna.constants import Constants
+
+
+class InjectManifest:
+    """
+    Record of what went into an injected script_text MZP, kept next to it as
+    <mrg path>.manifest.json. It holds a digest of the render settings, a
+    digest of the inputs of every scene, and the order in which offsets
+    appear in the string table, so that a later inject can reuse the
+    rendered strings of every scene whose inputs are unchanged.
+    """
+
+    # Bump whenever rendering or the manifest format changes
+    VERSION = 1
+
+    SUFFIX = '.manifest.json'
+
+    def __init__(self, settings_digest, scene_digests, offsets,
+                 tables_digest):
+        self.settings_digest = settings_digest
+        self.scene_digests = scene_digests
+        # Offsets with a (non-empty) string, in string table order
+        self.offsets = offsets
+        # Digest of the offset and string tables as written
+        self.tables_digest = tables_digest
+
+    @classmethod
+    def path_for(cls, mrg_path):
+        return mrg_path + cls.SUFFIX
+
+    @classmethod
+    def digest_settings(cls, perform_charswap, enable_pua_codes,
+                        charswap_map):
+        return hashlib.sha1(json.dumps([
+            cls.VERSION,
+            Constants.CHARS_PER_LINE,
+            perform_charswap,
+            enable_pua_codes,
+            sorted(charswap_map.items()) if perform_charswap else None,
+        ]).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def digest_scene(scene_name, commands, tl_line_for_cmd):
+        # Everything that rendering a scene looks at
+        digest = hashlib.sha1(scene_name.encode('utf-8'))
+        for cmd in commands:
+            tl_line = tl_line_for_cmd(cmd)
+            digest.update(json.dumps([
+                cmd.offset, cmd.page_number, cmd.is_glued,
+                tl_line.jp_text, tl_line.en_text
+            ]).encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def digest_tables(offset_table, string_table):
+        digest = hashlib.sha1(offset_table)
+        digest.update(string_table)
+        return digest.hexdigest()
+
+    @classmethod
+    def load(cls, mrg_path):
+        # Returns None if there is no usable manifest
+        try:
+            with open(cls.path_for(mrg_path), 'rb') as manifest_file:
+                jsonb = json.loads(manifest_file.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if jsonb.get('version') != cls.VERSION:
+            return None
+
+        return cls(
+            jsonb['settings_digest'],
+            jsonb['scene_digests'],
+            jsonb['offsets'],
+            jsonb['tables_digest'],
+        )
+
+    def save(self, mrg_path):
+        path = self.path_for(mrg_path)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as manifest_file:
+            manifest_file.write(json.dumps({
+                'version': self.VERSION,
+                'settings_digest': self.settings_digest,
+                'scene_digests': self.scene_digests,
+                'offsets': self.offsets,
+                'tables_digest': self.tables_digest,
+            }).encode('utf-8'))
+        os.replace(temp_path, path)
+
+    def matches_tables(self, offset_table, string_table):
+        # Whether the tables are still the ones written with this manifest
+        return self.digest_tables(offset_table, string_table) == \
+            self.tables_digest
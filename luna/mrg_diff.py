@@ -0,0 +1,136 @@
+import hashlib
+
+from luna.mrg_parser import Mzp
+from luna.translation_db import TranslationDb
+
+
+class MrgDiff:
+    """
+    Section-by-section comparison of two MZP archives.
+    Sections are compared by hash, straight from memory mappings of the
+    archives. For script text archives, which consist of pairs of offset
+    and string tables, differing pairs are further broken down into the
+    individual string offsets that changed.
+    """
+
+    class SectionDiff:
+        def __init__(self, index, digest_a, digest_b, size_a, size_b):
+            self.index = index
+            self.digest_a = digest_a
+            self.digest_b = digest_b
+            self.size_a = size_a
+            self.size_b = size_b
+
+        def __repr__(self):
+            return (
+                f"Section {self.index}: "
+                f"{self.digest_a or 'missing'} ({self.size_a} bytes) -> "
+                f"{self.digest_b or 'missing'} ({self.size_b} bytes)"
+            )
+
+    def __init__(self, path_a, path_b):
+        self.path_a = path_a
+        self.path_b = path_b
+
+        # List of SectionDiffs for sections that differ
+        self.changed_sections = []
+
+        # Map of string table pair (offset table index, string table index)
+        # to the sorted list of string offsets that differ
+        self.changed_strings = {}
+
+        with Mzp(path_a) as mzp_a, Mzp(path_b) as mzp_b:
+            self._compare(mzp_a, mzp_b)
+
+    @staticmethod
+    def section_digest(section):
+        return hashlib.sha1(section).hexdigest()
+
+    @classmethod
+    def section_digests(cls, path):
+        with Mzp(path) as mzp:
+            return [cls.section_digest(section) for section in mzp.data]
+
+    def is_identical(self):
+        return not self.changed_sections
+
+    def _compare(self, mzp_a, mzp_b):
+        section_count = max(len(mzp_a.data), len(mzp_b.data))
+        for i in range(section_count):
+            section_a = mzp_a.data[i] if i < len(mzp_a.data) else None
+            section_b = mzp_b.data[i] if i < len(mzp_b.data) else None
+            digest_a = (
+                self.section_digest(section_a) if section_a is not None
+                else None
+            )
+            digest_b = (
+                self.section_digest(section_b) if section_b is not None
+                else None
+            )
+            if digest_a != digest_b:
+                self.changed_sections.append(MrgDiff.SectionDiff(
+                    i, digest_a, digest_b,
+                    len(section_a) if section_a is not None else 0,
+                    len(section_b) if section_b is not None else 0,
+                ))
+            del section_a, section_b
+
+        # Script text archives are made up of offset/string table pairs.
+        # Other archives (e.g. allscr) can have an even section count too,
+        # so check that each pair really is one before looking at strings.
+        if section_count % 2 or len(mzp_a.data) != len(mzp_b.data):
+            return
+
+        changed = set(diff.index for diff in self.changed_sections)
+        for i in range(0, section_count, 2):
+            if i not in changed and i + 1 not in changed:
+                continue
+            pair_a = (mzp_a.data[i], mzp_a.data[i + 1])
+            pair_b = (mzp_b.data[i], mzp_b.data[i + 1])
+            if self.is_string_table_pair(*pair_a) and \
+                    self.is_string_table_pair(*pair_b):
+                self.changed_strings[(i, i + 1)] = self._compare_strings(
+                    *pair_a, *pair_b)
+            del pair_a, pair_b
+
+    @staticmethod
+    def is_string_table_pair(offsets, strings):
+        # Whether offsets is a script text offset table for strings: whole
+        # u32s, with the strings running back to back from the start of
+        # the string table up to exactly its end
+        if len(offsets) < 8 or len(offsets) % 4:
+            return False
+
+        ranges = TranslationDb.string_table_ranges(offsets)
+        if not ranges:
+            return len(strings) == 0
+
+        return (
+            ranges[0][1] == 0
+            and all(start < end for _, start, end in ranges)
+            and ranges[-1][2] == len(strings)
+        )
+
+    @staticmethod
+    def _compare_strings(offsets_a, strings_a, offsets_b, strings_b):
+        ranges_a = {
+            offset: (start, end) for offset, start, end
+            in TranslationDb.string_table_ranges(offsets_a)
+        }
+        ranges_b = {
+            offset: (start, end) for offset, start, end
+            in TranslationDb.string_table_ranges(offsets_b)
+        }
+
+        changed_offsets = []
+        for offset in sorted(ranges_a.keys() | ranges_b.keys()):
+            if offset not in ranges_a or offset not in ranges_b:
+                changed_offsets.append(offset)
+                continue
+
+            (start_a, end_a) = ranges_a[offset]
+            (start_b, end_b) = ranges_b[offset]
+            if strings_a[start_a:end_a] != strings_b[start_b:end_b]:
+                changed_offsets.append(offset)
+
+        return changed_offsets
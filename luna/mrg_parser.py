@@ -1,10 +1,22 @@
+import collections
+import hashlib
 import io
+import mmap
+import os
 import struct
 
 
 class Mzp:
     MAGIC = b"mrgd00"
 
+    # Sections start on 16 byte boundaries, the archive ends on an 8 byte one
+    SECTION_ALIGNMENT = 16
+    FILE_ALIGNMENT = 8
+    PADDING_BYTE = b"\xff"
+
+    # Chunk size used when copying file object sections
+    COPY_CHUNK_SIZE = 0x10000
+
     class EntryHeader:
         HEADER_FORMAT = "<HHHH"
         SECTOR_SIZE = 0x800
@@ -21,6 +33,21 @@ class Mzp:
                 f"{self._size_sectors}, {self._size_bytes}>"
             )
 
+        @classmethod
+        def pack(cls, start_offset, size):
+            # Pack the header for a section of size bytes starting at
+            # start_offset relative to the start of the data area
+            size_sectors = size // cls.SECTOR_SIZE
+            if size % cls.SECTOR_SIZE:
+                size_sectors += 1
+            return struct.pack(
+                cls.HEADER_FORMAT,
+                start_offset // cls.SECTOR_SIZE,
+                start_offset % cls.SECTOR_SIZE,
+                size_sectors,
+                size & 0xFFFF
+            )
+
         def relative_start_offset(self):
             return self._sector_offset * self.SECTOR_SIZE + self._byte_offset
 
@@ -28,73 +55,359 @@ class Mzp:
             upper_bound = self._size_sectors * self.SECTOR_SIZE
             return (upper_bound & ~(0xFFFF)) | self._size_bytes
 
-    def __init__(self, input_path):
-        with open(input_path, 'rb') as input_file:
-            raw_data = input_file.read()
+    def __init__(self, source):
+        # Source is either a path to an MZP file, which gets memory mapped,
+        # or any buffer protocol object (bytes, memoryview, mmap) holding the
+        # archive data.
+        self._mapping = None
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as input_file:
+                self._mapping = mmap.mmap(
+                    input_file.fileno(), 0, access=mmap.ACCESS_READ)
+            source = self._mapping
+        self._raw_data = memoryview(source).cast('B')
 
         # Data are LE
         # 6 byte magic, uint16_t entry count
-        (self._magic, self._entry_count) = struct.unpack("<6sH", raw_data[0:8])
+        (self._magic, self._entry_count) = struct.unpack(
+            "<6sH", self._raw_data[0:8])
 
         assert self._magic == self.MAGIC, self._magic
+        assert len(self._raw_data) >= 8 + 8 * self._entry_count, \
+            f"Header table truncated for {self._entry_count} entries"
 
-        # Parse the headers
-        data_view = memoryview(raw_data)
+        # Parse the headers. Entry data is only touched on access.
         self.headers = []
         for i in range(self._entry_count):
-            self.headers.append(Mzp.EntryHeader(data_view[8 + 8 * i:]))
+            self.headers.append(
+                Mzp.EntryHeader(self._raw_data[8 + 8 * i:8 + 8 * (i + 1)]))
+
+        self.data = Mzp.EntryList(self._raw_data, self.headers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        # Any entries handed out must be released before closing
+        self._raw_data.release()
+        if self._mapping is not None:
+            self._mapping.close()
+
+    def entry_range(self, index):
+        # Absolute (start, size) of an entry within the archive
+        return self.data.entry_range(index)
+
+    class EntryList:
+        """
+        Lazy sequence of the entries in an archive, materializing each entry
+        only when it is accessed. Entries are views onto the archive data,
+        so nothing is copied.
+        """
+
+        def __init__(self, raw_data, headers):
+            self._raw_data = raw_data
+            self._headers = headers
+
+        def entry_range(self, index):
+            header = self._headers[index]
+            data_start_offset = 8 + 8 * len(self._headers)
+            return (
+                data_start_offset + header.relative_start_offset(),
+                header.data_size()
+            )
+
+        def __len__(self):
+            return len(self._headers)
+
+        def __getitem__(self, index):
+            if isinstance(index, slice):
+                return [
+                    self[i] for i in range(*index.indices(len(self)))
+                ]
+
+            (entry_start, entry_size) = self.entry_range(index)
+            return self._raw_data[entry_start:entry_start + entry_size]
 
-        # Load the data
-        self.data = []
-        data_start_offset = 8 + 8 * self._entry_count
-        for header in self.headers:
-            entry_start = data_start_offset + header.relative_start_offset()
-            self.data.append(raw_data[
-                entry_start:entry_start+header.data_size()])
+        def __iter__(self):
+            for i in range(len(self)):
+                yield self[i]
 
     @classmethod
-    def pack(cls, sections):
-        # Generate header
-        header = struct.pack("<6sH", cls.MAGIC, len(sections))
-        packed_header = io.BytesIO()
-        packed_header.write(header)
-
-        # Process each section
-        packed_data = io.BytesIO()
-        for section in sections:
+    def pack(cls, sections, pool=False):
+        packed = io.BytesIO()
+        cls.write(packed, sections, pool=pool)
+        return packed.getvalue()
+
+    @classmethod
+    def write(cls, output, sections, pool=False):
+        # Write an archive to output, which is either a path or a binary file
+        # object. Sections may be buffers, binary file objects or iterables
+        # of byte chunks. If every section size can be determined up front
+        # the archive is written strictly sequentially, otherwise the header
+        # table is filled in afterwards, which requires a seekable output.
+        # With pool, buffer sections with identical contents are stored once
+        # and share their data. Returns the total size written.
+        if isinstance(output, (str, os.PathLike)):
+            with open(output, 'wb') as output_file:
+                return cls.write(output_file, sections, pool=pool)
+
+        sections = list(sections)
+        section_sizes = [cls._section_size(section) for section in sections]
+        sizes_known = None not in section_sizes
+        shared_with = cls._shared_sections(sections) if pool \
+            else [None] * len(sections)
+
+        # Write the header, or a placeholder for it if we can't lay out the
+        # sections yet
+        archive_start = output.tell()
+        output.write(
+            cls._header_table(section_sizes, shared_with) if sizes_known
+            else bytes(8 + 8 * len(sections))
+        )
+
+        # Stream out each section
+        data_size = 0
+        for i, section in enumerate(sections):
+            if shared_with[i] is not None:
+                continue
+
             # Round the start of each section to a word boundary
-            while packed_data.tell() % 16 != 0:
-                packed_data.write(b"\xff")
-
-            # Calculate the header info
-            section_start_offset = packed_data.tell()
-            section_sector_offset = \
-                section_start_offset // cls.EntryHeader.SECTOR_SIZE
-            section_byte_offset = \
-                section_start_offset % cls.EntryHeader.SECTOR_SIZE
-            size_sectors = len(section) // cls.EntryHeader.SECTOR_SIZE
-            size_bytes = len(section) & 0xFFFF
-            if len(section) % cls.EntryHeader.SECTOR_SIZE:
-                size_sectors += 1
-            packed_header.write(struct.pack(
-                cls.EntryHeader.HEADER_FORMAT,
-                section_sector_offset,
-                section_byte_offset,
-                size_sectors,
-                size_bytes
-            ))
+            padding = -data_size % cls.SECTION_ALIGNMENT
+            output.write(cls.PADDING_BYTE * padding)
+            data_size += padding
+
+            written = cls._write_section(output, section)
+            assert section_sizes[i] is None or written == section_sizes[i], \
+                f"Section {i} changed size while writing"
+            section_sizes[i] = written
+            data_size += written
+
+        # Pad total file size to boundary. The header is already aligned.
+        output.write(cls.PADDING_BYTE * (-data_size % cls.FILE_ALIGNMENT))
+
+        # Fill in the header now that we know the section sizes
+        end = output.tell()
+        if not sizes_known:
+            output.seek(archive_start)
+            output.write(cls._header_table(section_sizes, shared_with))
+            output.seek(end)
 
-            # Append the section data to the data buffer
-            packed_data.write(section)
+        return end - archive_start
 
-        # Consolidate data onto header buffer
-        packed_data.seek(0, io.SEEK_SET)
-        packed_header.write(packed_data.read())
+    @classmethod
+    def packed_size(cls, sections, pool=False):
+        # Size of the archive that write() produces for buffer sections
+        sections = list(sections)
+        shared_with = cls._shared_sections(sections) if pool \
+            else [None] * len(sections)
+        data_size = 0
+        for section, shared_index in zip(sections, shared_with):
+            if shared_index is None:
+                data_size += -data_size % cls.SECTION_ALIGNMENT
+                data_size += cls._section_size(section)
+        data_size += -data_size % cls.FILE_ALIGNMENT
+
+        return 8 + 8 * len(sections) + data_size
+
+    @staticmethod
+    def _shared_sections(sections):
+        # For each section, the index of an earlier section with identical
+        # contents, or None. Only non-empty buffers can be compared up front.
+        # Sections are keyed on their size and digest rather than copied.
+        first_by_key = collections.defaultdict(list)
+        shared_with = []
+        for i, section in enumerate(sections):
+            try:
+                with memoryview(section) as view:
+                    key = (view.nbytes, hashlib.sha1(view).digest())
+            except TypeError:
+                key = None
+
+            if key is None or not key[0]:
+                shared_with.append(None)
+                continue
+
+            # Make sure that matching digests really are the same contents
+            candidates = first_by_key[key]
+            shared_index = None
+            for candidate in candidates:
+                with memoryview(sections[candidate]) as first, \
+                        memoryview(section) as view:
+                    if first.cast('B') == view.cast('B'):
+                        shared_index = candidate
+                        break
+
+            shared_with.append(shared_index)
+            if shared_index is None:
+                candidates.append(i)
+
+        return shared_with
+
+    def shares_data(self):
+        # Whether any entries point at the same data, as in pooled archives
+        return self._headers_share_data(self.headers)
+
+    @staticmethod
+    def _headers_share_data(headers):
+        starts = [
+            header.relative_start_offset() for header in headers
+            if header.data_size()
+        ]
+        return len(set(starts)) != len(starts)
+
+    @classmethod
+    def patch(cls, target, replacements):
+        # Replace sections of an existing archive in place. target is a path
+        # or a seekable binary file object opened for update, replacements
+        # maps section index to new section data (as accepted by write()).
+        # Sections before the first replaced one are left untouched. If no
+        # replaced section changes size, only the replaced sections are
+        # rewritten, otherwise everything from the first replaced section
+        # onward is rewritten along with the header table. Pooled archives
+        # are always rewritten in full.
+        if isinstance(target, (str, os.PathLike)):
+            with open(target, 'r+b') as target_file:
+                return cls.patch(target_file, replacements)
+
+        if not replacements:
+            return
+
+        # Read the existing header table
+        target.seek(0)
+        (magic, entry_count) = struct.unpack("<6sH", target.read(8))
+        assert magic == cls.MAGIC, magic
+        header_table = target.read(8 * entry_count)
+        headers = [
+            cls.EntryHeader(header_table[8 * i:8 * (i + 1)])
+            for i in range(entry_count)
+        ]
+        for index in replacements:
+            assert 0 <= index < entry_count, \
+                f"Section {index} out of range for {entry_count} sections"
+
+        data_start_offset = 8 + 8 * entry_count
+        section_sizes = [header.data_size() for header in headers]
+
+        # Sections of a pooled archive can't be replaced independently, so
+        # rewrite the whole thing, pooled again
+        if cls._headers_share_data(headers):
+            sections = []
+            for index in range(entry_count):
+                if index in replacements:
+                    sections.append(replacements[index])
+                    continue
+                target.seek(
+                    data_start_offset + headers[index].relative_start_offset())
+                sections.append(target.read(section_sizes[index]))
+
+            target.seek(0)
+            cls.write(target, sections, pool=True)
+            target.truncate()
+            return
+
+        # Same-size replacements can simply be overwritten where they are
+        if all(cls._section_size(section) == section_sizes[index]
+               for index, section in replacements.items()):
+            for index, section in replacements.items():
+                target.seek(
+                    data_start_offset + headers[index].relative_start_offset())
+                cls._write_section(target, section)
+            return
+
+        # Everything after the first replaced section is going to move, so
+        # pull in any sections there that we aren't replacing
+        first_index = min(replacements)
+        tail_sections = {}
+        for index in range(first_index, entry_count):
+            if index in replacements:
+                tail_sections[index] = replacements[index]
+                continue
+            target.seek(
+                data_start_offset + headers[index].relative_start_offset())
+            tail_sections[index] = target.read(section_sizes[index])
+
+        # Rewrite from the first replaced section onward
+        new_headers = []
+        data_size = headers[first_index].relative_start_offset()
+        target.seek(data_start_offset + data_size)
+        for index in range(first_index, entry_count):
+            padding = -data_size % cls.SECTION_ALIGNMENT
+            target.write(cls.PADDING_BYTE * padding)
+            data_size += padding
+
+            section_size = cls._write_section(target, tail_sections[index])
+            new_headers.append(cls.EntryHeader.pack(data_size, section_size))
+            data_size += section_size
+
+        target.write(cls.PADDING_BYTE * (-data_size % cls.FILE_ALIGNMENT))
+        target.truncate()
+
+        # Finally, the new headers. Sections before the first replaced one
+        # keep their original headers.
+        target.seek(8 + 8 * first_index)
+        target.write(b''.join(new_headers))
+
+    @classmethod
+    def _header_table(cls, section_sizes, shared_with):
+        header = [struct.pack("<6sH", cls.MAGIC, len(section_sizes))]
+        section_starts = []
+        section_start_offset = 0
+        for size, shared_index in zip(section_sizes, shared_with):
+            if shared_index is not None:
+                section_starts.append(section_starts[shared_index])
+                header.append(cls.EntryHeader.pack(
+                    section_starts[shared_index], size))
+                continue
+
+            section_start_offset += \
+                -section_start_offset % cls.SECTION_ALIGNMENT
+            section_starts.append(section_start_offset)
+            header.append(cls.EntryHeader.pack(section_start_offset, size))
+            section_start_offset += size
+
+        return b''.join(header)
+
+    @staticmethod
+    def _section_size(section):
+        # Size of a section in bytes, or None if it can't be known without
+        # consuming it
+        if hasattr(section, 'read'):
+            if not section.seekable():
+                return None
+            position = section.tell()
+            size = section.seek(0, io.SEEK_END) - position
+            section.seek(position)
+            return size
+
+        try:
+            with memoryview(section) as view:
+                return view.nbytes
+        except TypeError:
+            return None
+
+    @classmethod
+    def _write_section(cls, output, section):
+        if hasattr(section, 'read'):
+            written = 0
+            while True:
+                chunk = section.read(cls.COPY_CHUNK_SIZE)
+                if not chunk:
+                    return written
+                output.write(chunk)
+                written += len(chunk)
 
-        # Pad total file size to boundary
-        while packed_header.tell() % 8 != 0:
-            packed_header.write(b"\xff")
+        try:
+            with memoryview(section) as view:
+                output.write(view)
+                return view.nbytes
+        except TypeError:
+            pass
 
-        # Return accumulated data
-        packed_header.seek(0, io.SEEK_SET)
-        return packed_header.read()
+        written = 0
+        for chunk in section:
+            output.write(chunk)
+            written += len(chunk)
+        return written
@@ -1,3 +1,4 @@
+import array
 import os
 import struct
 from io import BytesIO
@@ -9,8 +10,273 @@ class Mzx:
     CMD_RINGBUF = 2
     CMD_LITERAL = 3
 
+    # Available decoder implementations
+    ENGINE_BYTESIO = 'bytesio'
+    ENGINE_BYTEARRAY = 'bytearray'
+    DEFAULT_ENGINE = ENGINE_BYTEARRAY
+
+    # Largest amount of data a single command can emit (64 shorts)
+    MAX_CMD_OUTPUT = 64 * 2
+
+    # Translation tables used to (not) invert literal data in one pass
+    INVERT_TABLE = bytes(b ^ 0xFF for b in range(256))
+    IDENTITY_TABLE = bytes(range(256))
+
+    # Default output chunk size for the streaming decoder
+    DEFAULT_CHUNK_SIZE = 0x1000
+
+    # Compressor limits. Each command covers at most 64 shorts, and
+    # backreferences can reach at most 256 shorts into the past.
+    MAX_CMD_SHORTS = 64
+    MAX_LOOKBACK_SHORTS = 256
+
+    # Number of match candidates the compressor examines per position
+    MAX_CHAIN_LENGTH = 32
+
+    @classmethod
+    def compress(cls, data, invert=True):
+        # Everything is encoded in units of 16 bit shorts. Pad odd-length
+        # input, the header carries the real size so the decoder truncates.
+        data = bytes(data)
+        shorts = array.array('H', data + b'\x00' * (len(data) % 2))
+        short_count = len(shorts)
+        literal_mask = 0xFFFF if invert else 0x0000
+
+        ret = bytearray(struct.pack("<4sI", b"MZX0", len(data)))
+
+        # Mirror of the decoder state: last written short and ringbuffer of
+        # previous literals, plus a value -> slot index of the ringbuffer
+        last_short = 0xFFFF if invert else 0x0000
+        ring_buffer = [last_short] * 64
+        ring_buffer_index = {last_short: 0}
+        ring_buffer_write_offset = 0
+
+        # Hash chains of previous positions, keyed by the pair of shorts
+        # starting at that position
+        chain_head = {}
+        chain_prev = [-1] * short_count
+
+        # Literals waiting to be emitted as a single command
+        pending_literals = array.array('H')
+
+        def flush_literals():
+            for i in range(0, len(pending_literals), cls.MAX_CMD_SHORTS):
+                chunk = pending_literals[i:i + cls.MAX_CMD_SHORTS]
+                ret.append(((len(chunk) - 1) << 2) | cls.CMD_LITERAL)
+                ret.extend(array.array(
+                    'H', [short ^ literal_mask for short in chunk]
+                ).tobytes())
+            del pending_literals[:]
+
+        read_offset = 0
+        while read_offset < short_count:
+            limit = min(cls.MAX_CMD_SHORTS, short_count - read_offset)
+
+            # How many times does the last short repeat from here?
+            run_length = 0
+            while run_length < limit and \
+                    shorts[read_offset + run_length] == last_short:
+                run_length += 1
+
+            # Find the longest match in the backreference window
+            match_length = 0
+            match_dist = 0
+            if limit >= 2:
+                candidate = chain_head.get(
+                    (shorts[read_offset] << 16) | shorts[read_offset + 1], -1)
+                tries = cls.MAX_CHAIN_LENGTH
+                while candidate >= 0 and tries and \
+                        read_offset - candidate <= cls.MAX_LOOKBACK_SHORTS:
+                    # The chain key guarantees the first two shorts match
+                    length = 2
+                    while length < limit and shorts[candidate + length] == \
+                            shorts[read_offset + length]:
+                        length += 1
+                    if length > match_length:
+                        match_length = length
+                        match_dist = read_offset - candidate
+                        if length == limit:
+                            break
+                    candidate = chain_prev[candidate]
+                    tries -= 1
+
+            # Pick the cheapest encoding for the data at this position
+            if match_length >= 2 and match_length > run_length:
+                flush_literals()
+                ret.append(((match_length - 1) << 2) | cls.CMD_BACKREF)
+                ret.append(match_dist - 1)
+                consumed = match_length
+                last_short = shorts[read_offset + match_length - 1]
+            elif run_length:
+                flush_literals()
+                ret.append(((run_length - 1) << 2) | cls.CMD_RLE)
+                consumed = run_length
+            elif shorts[read_offset] in ring_buffer_index:
+                flush_literals()
+                last_short = shorts[read_offset]
+                ret.append(
+                    (ring_buffer_index[last_short] << 2) | cls.CMD_RINGBUF)
+                consumed = 1
+            else:
+                # Literals land in the ringbuffer in the order they are
+                # decoded, so the model can be updated immediately.
+                last_short = shorts[read_offset]
+                pending_literals.append(last_short)
+                evicted = ring_buffer[ring_buffer_write_offset]
+                ring_buffer[ring_buffer_write_offset] = last_short
+                if ring_buffer_index.get(evicted) == ring_buffer_write_offset:
+                    del ring_buffer_index[evicted]
+                    if evicted in ring_buffer:
+                        ring_buffer_index[evicted] = \
+                            ring_buffer.index(evicted)
+                ring_buffer_index[last_short] = ring_buffer_write_offset
+                ring_buffer_write_offset = (ring_buffer_write_offset + 1) % 64
+                consumed = 1
+
+            # Index the positions we just consumed
+            for position in range(read_offset, read_offset + consumed):
+                if position + 1 < short_count:
+                    key = (shorts[position] << 16) | shorts[position + 1]
+                    chain_prev[position] = chain_head.get(key, -1)
+                    chain_head[key] = position
+
+            read_offset += consumed
+
+        flush_literals()
+        return bytes(ret)
+
+    @classmethod
+    def decompress(cls, data, invert=True, engine=None):
+        # Data may be any buffer protocol object (bytes, memoryview, mmap).
+        # Access it through a byte view so that nothing gets copied.
+        engine = engine or cls.DEFAULT_ENGINE
+        with memoryview(data).cast('B') as view:
+            if engine == cls.ENGINE_BYTEARRAY:
+                return cls._decompress_bytearray(view, invert)
+            if engine == cls.ENGINE_BYTESIO:
+                return cls._decompress_bytesio(view, invert)
+
+        raise ValueError(f"Unknown MZX engine '{engine}'")
+
+    @classmethod
+    def decompress_iter(cls, source, invert=True,
+                        chunk_size=DEFAULT_CHUNK_SIZE):
+        # Incrementally decompress an MZX stream, yielding chunks of roughly
+        # chunk_size bytes. Source may either be a complete compressed blob
+        # or an iterable of compressed chunks.
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            view = memoryview(source)
+            source = (
+                view[i:i + chunk_size]
+                for i in range(0, len(view), chunk_size)
+            )
+
+        decoder = cls.Decoder(invert)
+        for data in source:
+            decoder.feed(data)
+            while True:
+                chunk = decoder.decode(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+            if decoder.finished:
+                break
+
+        decoder.close()
+
+    @classmethod
+    def _decompress_bytearray(cls, data, invert=True):
+        # Check header
+        (magic, decompressed_size) = struct.unpack("<4sI", data[0:8])
+        assert magic == b"MZX0", magic
+
+        # Preallocate the output buffer. Commands can overshoot the end by at
+        # most one command's worth of data, which is truncated at the end.
+        ret = bytearray(decompressed_size + cls.MAX_CMD_OUTPUT)
+        write_offset = 0
+
+        # Last written short
+        last_short = b'\xff\xff' if invert else b'\x00\x00'
+
+        # Prev data ringbuffer
+        ring_buffer_write_offset = 0
+        ring_buffer = [b'\xff\xff' if invert else b'\x00\x00'] * 64
+
+        # Literal data is inverted with a single translate per command
+        literal_table = cls.INVERT_TABLE if invert else cls.IDENTITY_TABLE
+
+        # Input file read index. Start after the fixed-size header.
+        read_offset = 8
+
+        # While we have not decompressed all data
+        while write_offset < decompressed_size:
+            # Read the cmd/len from the next input byte
+            len_cmd = data[read_offset]
+            read_offset += 1
+
+            # Extract the actual command and length
+            cmd = len_cmd & 0b11
+            length = len_cmd >> 2
+
+            if cmd == cls.CMD_RLE:
+                # Repeat last 2 bytes len+1 times
+                run = last_short * (length + 1)
+                ret[write_offset:write_offset + len(run)] = run
+                write_offset += len(run)
+
+            elif cmd == cls.CMD_BACKREF:
+                # How far back are we referencing
+                lookback_dist = 2 * (data[read_offset] + 1)
+                read_offset += 1
+                copy_len = 2 * (length + 1)
+                copy_start = write_offset - lookback_dist
+                assert copy_start >= 0, \
+                    f"Backreference before start of data at {read_offset}"
+
+                if lookback_dist >= copy_len:
+                    # Non-overlapping: a single slice copy will do
+                    ret[write_offset:write_offset + copy_len] = \
+                        ret[copy_start:copy_start + copy_len]
+                else:
+                    # Overlapping: the referenced window repeats
+                    window = ret[copy_start:write_offset]
+                    repeats = copy_len // lookback_dist + 1
+                    ret[write_offset:write_offset + copy_len] = \
+                        (window * repeats)[:copy_len]
+                write_offset += copy_len
+                last_short = bytes(ret[write_offset - 2:write_offset])
+
+            elif cmd == cls.CMD_RINGBUF:
+                last_short = ring_buffer[length]
+                ret[write_offset:write_offset + 2] = last_short
+                write_offset += 2
+
+            else:
+                # Read len+1 short literals from the input and (un)invert them
+                literal_len = 2 * (length + 1)
+                literal_bytes = bytes(
+                    data[read_offset:read_offset + literal_len]
+                ).translate(literal_table)
+                read_offset += literal_len
+
+                # Update last / ring buffer
+                for i in range(0, len(literal_bytes), 2):
+                    ring_buffer[ring_buffer_write_offset] = \
+                        literal_bytes[i:i + 2]
+                    ring_buffer_write_offset = \
+                        (ring_buffer_write_offset + 1) % 64
+                last_short = literal_bytes[-2:]
+
+                # Write data to output
+                ret[write_offset:write_offset + len(literal_bytes)] = \
+                    literal_bytes
+                write_offset += len(literal_bytes)
+
+        return bytes(ret[:decompressed_size])
+
     @classmethod
-    def decompress(cls, data, invert=True):
+    def _decompress_bytesio(cls, data, invert=True):
         # Check header
         (magic, decompressed_size) = struct.unpack("<4sI", data[0:8])
         assert magic == b"MZX0", magic
@@ -19,7 +285,7 @@ class Mzx:
         ret = BytesIO()
 
         # Last written short
-        last_short = b'\xff\xff' if invert else 0x0000
+        last_short = b'\xff\xff' if invert else b'\x00\x00'
 
         # Prev data ringbuffer
         ring_buffer_write_offset = 0
@@ -82,3 +348,137 @@ class Mzx:
         ret.truncate(decompressed_size)
         ret.seek(0)
         return ret.read()
+
+    class Decoder:
+        """
+        Incremental MZX decoder.
+        Compressed data is pushed in with feed(), and decompressed data is
+        pulled out with decode(). Only the trailing backreference window of
+        the output is retained between calls, so memory use is bounded by
+        the window plus the size of the chunk being returned.
+        """
+
+        # Backreferences can reach at most 256 shorts into the past
+        WINDOW_SIZE = 256 * 2
+
+        def __init__(self, invert=True):
+            self._invert = invert
+            self._literal_table = \
+                Mzx.INVERT_TABLE if invert else Mzx.IDENTITY_TABLE
+
+            # Unconsumed compressed input
+            self._pending = bytearray()
+
+            # Decompressed size from the header, None until it is parsed
+            self._decompressed_size = None
+
+            # Total number of bytes decoded / returned to the caller
+            self._decoded = 0
+            self._returned = 0
+
+            # Trailing output, used to resolve backreferences
+            self._window = bytearray()
+
+            # Last written short / prev data ringbuffer
+            self._last_short = b'\xff\xff' if invert else b'\x00\x00'
+            self._ring_buffer_write_offset = 0
+            self._ring_buffer = [self._last_short] * 64
+
+        @property
+        def finished(self):
+            return (
+                self._decompressed_size is not None
+                and self._returned >= self._decompressed_size
+            )
+
+        def feed(self, data):
+            self._pending += data
+
+        def decode(self, max_size=None):
+            # Parse the header once we have enough data for it
+            if self._decompressed_size is None:
+                if len(self._pending) < 8:
+                    return b''
+                (magic, self._decompressed_size) = struct.unpack(
+                    "<4sI", self._pending[0:8])
+                assert magic == b"MZX0", magic
+                del self._pending[:8]
+
+            # Decode as many complete commands as we have input for
+            out = self._window
+            chunk_start = len(out)
+            data = self._pending
+            read_offset = 0
+            while self._decoded < self._decompressed_size:
+                # Stop once we have a full chunk for the caller
+                if max_size is not None and \
+                        len(out) - chunk_start >= max_size:
+                    break
+
+                # Is the next command completely available?
+                if read_offset >= len(data):
+                    break
+                len_cmd = data[read_offset]
+                cmd = len_cmd & 0b11
+                length = len_cmd >> 2
+                cmd_len = (
+                    2 if cmd == Mzx.CMD_BACKREF else
+                    1 + 2 * (length + 1) if cmd == Mzx.CMD_LITERAL else
+                    1
+                )
+                if read_offset + cmd_len > len(data):
+                    break
+
+                if cmd == Mzx.CMD_RLE:
+                    # Repeat last 2 bytes len+1 times
+                    out += self._last_short * (length + 1)
+
+                elif cmd == Mzx.CMD_BACKREF:
+                    # Copy len+1 shorts from lookback_dist bytes ago
+                    lookback_dist = 2 * (data[read_offset + 1] + 1)
+                    copy_len = 2 * (length + 1)
+                    copy_start = len(out) - lookback_dist
+                    assert copy_start >= 0, \
+                        "Backreference before start of data"
+                    window = out[copy_start:]
+                    repeats = copy_len // lookback_dist + 1
+                    out += (window * repeats)[:copy_len]
+                    self._last_short = bytes(out[-2:])
+
+                elif cmd == Mzx.CMD_RINGBUF:
+                    self._last_short = self._ring_buffer[length]
+                    out += self._last_short
+
+                else:
+                    # Read len+1 short literals and (un)invert them
+                    literal_bytes = bytes(
+                        data[read_offset + 1:read_offset + cmd_len]
+                    ).translate(self._literal_table)
+                    for i in range(0, len(literal_bytes), 2):
+                        self._ring_buffer[self._ring_buffer_write_offset] = \
+                            literal_bytes[i:i + 2]
+                        self._ring_buffer_write_offset = \
+                            (self._ring_buffer_write_offset + 1) % 64
+                    self._last_short = literal_bytes[-2:]
+                    out += literal_bytes
+
+                read_offset += cmd_len
+                self._decoded = self._returned + len(out) - chunk_start
+
+            del data[:read_offset]
+
+            # Hand back the new data, clamped to the declared size
+            chunk = bytes(out[chunk_start:chunk_start + (
+                self._decompressed_size - self._returned)])
+            self._returned += len(chunk)
+
+            # Only keep as much output as backreferences can reach
+            del out[:-self.WINDOW_SIZE]
+
+            return chunk
+
+        def close(self):
+            assert self.finished, (
+                f"MZX stream truncated after {self._returned} of "
+                f"{self._decompressed_size} bytes"
+            )
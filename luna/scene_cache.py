@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+
+
+class SceneCache:
+    """
+    Persistent, content-addressed cache of parsed allscr scenes.
+    Each entry is keyed by a hash of a scene's compressed MZX data together
+    with a digest of the script text tables used while parsing it, and holds
+    the JSON form of the scene's text commands. The cache directory is kept
+    below max_bytes by evicting the least recently used entries.
+    """
+
+    # Bump whenever the parser output or entry format changes
+    VERSION = 1
+
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def context_digest(cls, *buffers):
+        # Digest of any additional data that parse results depend on
+        digest = hashlib.sha1(f"SceneCache{cls.VERSION}".encode('utf-8'))
+        for buffer in buffers:
+            digest.update(len(buffer).to_bytes(8, 'little'))
+            digest.update(buffer)
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(compressed, context_digest):
+        digest = hashlib.sha1(context_digest.encode('utf-8'))
+        digest.update(compressed)
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self._cache_dir, f"{key}.json")
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                entry = json.loads(entry_file.read())
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except ValueError:
+            # Damaged entry, drop it and treat as a miss
+            os.unlink(path)
+            self.misses += 1
+            return None
+
+        # Bump the access time so that eviction is least-recently-used
+        os.utime(path)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        try:
+            os.makedirs(self._cache_dir)
+        except FileExistsError:
+            pass
+
+        # Write to a temp file first so concurrent readers never see a
+        # partially written entry
+        path = self._entry_path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as entry_file:
+            entry_file.write(json.dumps(entry).encode('utf-8'))
+        os.replace(temp_path, path)
+
+    def evict(self):
+        # Remove the least recently used entries until we fit in max_bytes
+        try:
+            entries = [
+                entry for entry in os.scandir(self._cache_dir)
+                if entry.name.endswith('.json')
+            ]
+        except FileNotFoundError:
+            return
+
+        stats = [(entry.path, entry.stat()) for entry in entries]
+        total_bytes = sum(stat.st_size for _, stat in stats)
+        for path, stat in sorted(stats, key=lambda e: e[1].st_mtime):
+            if total_bytes <= self._max_bytes:
+                break
+            os.unlink(path)
+            total_bytes -= stat.st_size
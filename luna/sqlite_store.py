@@ -0,0 +1,277 @@
+import collections.abc
+import contextlib
+import json
+import os
+import sqlite3
+
+
+class SqliteStore:
+    """
+    SQLite storage engine for the translation DB.
+    Scenes, content-addressed lines and offset overrides are loaded from the
+    database on demand, and every edit is written back as its own small
+    transaction (or as part of an enclosing batch()), so saving the DB never
+    has to rewrite it wholesale.
+    The database runs in WAL mode so that several tools may have it open at
+    once. Rows that have already been loaded are cached, so edits made by
+    another process only become visible after reopening the DB.
+    """
+
+    MAGIC = b'SQLite format 3\0'
+    SCHEMA_VERSION = 1
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS meta ("
+        "key TEXT PRIMARY KEY, value TEXT)",
+        "CREATE TABLE IF NOT EXISTS scenes ("
+        "position INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, "
+        "commands TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS lines ("
+        "jp_hash TEXT PRIMARY KEY, jp_text TEXT, en_text TEXT, "
+        "comment TEXT) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS overrides ("
+        "offset INTEGER PRIMARY KEY, jp_text TEXT, en_text TEXT, "
+        "comment TEXT)",
+        "CREATE TABLE IF NOT EXISTS charswap ("
+        "key TEXT PRIMARY KEY, value TEXT)",
+    ]
+
+    def __init__(self, path):
+        self.path = path
+
+        # Transactions are managed explicitly, see _transaction
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._transaction_depth = 0
+
+        with self._transaction():
+            for statement in self.SCHEMA:
+                self._conn.execute(statement)
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO meta VALUES ('version', ?)",
+                    (str(self.SCHEMA_VERSION),))
+            else:
+                assert int(row[0]) == self.SCHEMA_VERSION, \
+                    f"Unsupported DB schema version {row[0]}"
+
+    @classmethod
+    def create(cls, path, db_contents):
+        # Write the full contents of a DB to a new database at path. The new
+        # database is built next to the destination and moved into place once
+        # complete, so this must not be used on a database that may be open
+        # elsewhere (see replace_contents).
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+        store = cls(temp_path)
+        try:
+            store.import_contents(*db_contents)
+            # Fold the WAL back into the main file before moving it
+            store._conn.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            store.close()
+
+        os.replace(temp_path, path)
+        return cls(path)
+
+    def close(self):
+        self._conn.close()
+
+    def covers(self, db_path):
+        # Every edit is already in the database itself
+        return os.path.exists(db_path) and os.path.samefile(self.path, db_path)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # Nested uses join the outermost transaction
+        if self._transaction_depth:
+            self._transaction_depth += 1
+            try:
+                yield
+            finally:
+                self._transaction_depth -= 1
+            return
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._transaction_depth = 1
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        else:
+            self._conn.execute("COMMIT")
+        finally:
+            self._transaction_depth = 0
+
+    def batch(self):
+        # Group several edits into one transaction
+        return self._transaction()
+
+    def import_contents(self, scene_map, line_by_hash, overrides_by_offset,
+                        charswap_map):
+        with self._transaction():
+            self._conn.executemany(
+                "INSERT INTO scenes VALUES (?, ?, ?)",
+                (
+                    (position, name,
+                     json.dumps([cmd.as_json() for cmd in commands]))
+                    for position, (name, commands)
+                    in enumerate(scene_map.items())
+                )
+            )
+            self._conn.executemany(
+                "INSERT INTO lines VALUES (?, ?, ?, ?)",
+                (
+                    (jp_hash, line.jp_text, line.en_text, line.comment)
+                    for jp_hash, line in line_by_hash.items()
+                )
+            )
+            self._conn.executemany(
+                "INSERT INTO overrides VALUES (?, ?, ?, ?)",
+                (
+                    (offset, line.jp_text, line.en_text, line.comment)
+                    for offset, line in overrides_by_offset.items()
+                )
+            )
+            self._conn.executemany(
+                "INSERT INTO charswap VALUES (?, ?)",
+                charswap_map.items()
+            )
+
+    def replace_contents(self, scene_map, line_by_hash, overrides_by_offset,
+                         charswap_map):
+        # Replace everything in the database with the full contents of a DB.
+        # This happens in one transaction on the database itself, so other
+        # connections see either the old or the new contents and keep
+        # writing to the same file.
+        with self._transaction():
+            for table in ('scenes', 'lines', 'overrides', 'charswap'):
+                self._conn.execute(f"DELETE FROM {table}")
+            self.import_contents(
+                scene_map, line_by_hash, overrides_by_offset, charswap_map)
+
+    def scene_map(self, text_command_cls):
+        return SqliteStore.RowMap(
+            self._conn, 'scenes', 'name', 'commands', order_by='position',
+            decode=lambda row: [
+                text_command_cls.from_json(cmd) for cmd in json.loads(row[0])
+            ]
+        )
+
+    def line_map(self, tl_line_cls):
+        return SqliteStore.RowMap(
+            self._conn, 'lines', 'jp_hash', 'jp_text, en_text, comment',
+            decode=lambda row: tl_line_cls(*row)
+        )
+
+    def override_map(self, tl_line_cls):
+        return SqliteStore.RowMap(
+            self._conn, 'overrides', 'offset', 'jp_text, en_text, comment',
+            decode=lambda row: tl_line_cls(*row)
+        )
+
+    def charswap_map(self):
+        return dict(self._conn.execute("SELECT key, value FROM charswap"))
+
+    def put_line(self, jp_hash, line):
+        with self._transaction():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO lines VALUES (?, ?, ?, ?)",
+                (jp_hash, line.jp_text, line.en_text, line.comment))
+
+    def put_override(self, offset, line):
+        with self._transaction():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO overrides VALUES (?, ?, ?, ?)",
+                (offset, line.jp_text, line.en_text, line.comment))
+
+    def clear_overrides(self):
+        with self._transaction():
+            self._conn.execute("DELETE FROM overrides")
+
+    def put_charswap_map(self, swap_map):
+        with self._transaction():
+            self._conn.execute("DELETE FROM charswap")
+            self._conn.executemany(
+                "INSERT INTO charswap VALUES (?, ?)", swap_map.items())
+
+    class RowMap(collections.abc.MutableMapping):
+        """
+        Mapping view of one table, loading and caching rows as they are
+        accessed. Assignments only update the cache, writes to the database
+        go through the put_* methods of the store.
+        """
+
+        def __init__(self, conn, table, key_column, value_columns, decode,
+                     order_by=None):
+            self._conn = conn
+            self._table = table
+            self._key_column = key_column
+            self._value_columns = value_columns
+            self._decode = decode
+            self._order_by = order_by or key_column
+
+            self._cache = {}
+            self._missing = set()
+            self._complete = False
+
+        def __getitem__(self, key):
+            if key in self._cache:
+                return self._cache[key]
+            if self._complete or key in self._missing:
+                raise KeyError(key)
+
+            row = self._conn.execute(
+                f"SELECT {self._value_columns} FROM {self._table} "
+                f"WHERE {self._key_column} = ?", (key,)).fetchone()
+            if row is None:
+                self._missing.add(key)
+                raise KeyError(key)
+
+            value = self._decode(row)
+            self._cache[key] = value
+            return value
+
+        def __setitem__(self, key, value):
+            self._missing.discard(key)
+            self._cache[key] = value
+
+        def __delitem__(self, key):
+            self._cache.pop(key, None)
+            self._missing.add(key)
+
+        def __iter__(self):
+            self._load_all()
+            return iter(self._cache)
+
+        def __len__(self):
+            self._load_all()
+            return len(self._cache)
+
+        def _load_all(self):
+            if self._complete:
+                return
+
+            # Keep anything already loaded (and possibly modified), and keep
+            # the table order for everything else
+            cache = {}
+            for row in self._conn.execute(
+                    f"SELECT {self._key_column}, {self._value_columns} "
+                    f"FROM {self._table} ORDER BY {self._order_by}"):
+                key = row[0]
+                if key in self._missing:
+                    continue
+                cache[key] = self._cache[key] if key in self._cache \
+                    else self._decode(row[1:])
+            for key, value in self._cache.items():
+                if key not in cache:
+                    cache[key] = value
+
+            self._cache = cache
+            self._complete = True
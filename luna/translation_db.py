@@ -1,14 +1,20 @@
-import io
-import copy
+import array
+import collections
+import contextlib
+import functools
 import hashlib
+import itertools
 import json
+import mmap
 import multiprocessing
 import os
 import re
-import struct
 import sys
 
 from luna.constants import Constants
+from luna.db_format import DbFormats
+from luna.db_journal import DbJournal
+from luna.inject_manifest import InjectManifest
 from luna.mrg_parser import Mzp
 from luna.mzx import Mzx
 from luna.readable_exporter import ReadableExporter
@@ -34,13 +40,89 @@ class TranslationDb:
             For these cases, allow storing overrides for a line.
     """
 
+    # Start of any allscr command that parse_script_cmds needs, on raw bytes
+    TEXT_CMD_PREFIX_REGEX = re.compile(rb"_(?:PGST|ZM|MSAD|SELR)")
+
+    # Command name/args of a single stripped allscr command
+    SCRIPT_CMD_REGEX = re.compile(
+        r"_(\w+)\(([\w 　a-zA-Z0-9-,`@$:.+^_]*)\)\Z")
+
+    # The same for ASCII-only commands, on raw bytes. For ASCII text these
+    # match exactly what their str counterparts do.
+    SCRIPT_CMD_BYTES_REGEX = re.compile(
+        rb"_(\w+)\(([\w a-zA-Z0-9-,`@$:.+^_]*)\)\Z")
+
+    # What str.strip() removes from ASCII text
+    ASCII_WHITESPACE = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
+
+    # Text references and modifiers within a command argument
+    TEXT_REF_REGEX = re.compile(r"(\$\d+)")
+    TEXT_MODIFIER_REGEX = re.compile(r"(\@\w)")
+    TEXT_REF_BYTES_REGEX = re.compile(rb"(\$\d+)")
+    TEXT_MODIFIER_BYTES_REGEX = re.compile(rb"(\@\w)")
+
     def __init__(self, scene_map, line_by_hash, overrides_by_offset,
-                 charswap_map=None):
+                 charswap_map=None, store=None):
         self._scene_map = scene_map
         self._line_by_hash = line_by_hash
         self._overrides_by_offset = overrides_by_offset
         self._charswap_map = charswap_map or {}
 
+        # Storage format used by to_file unless told otherwise
+        self._db_format = DbFormats.DEFAULT.NAME
+
+        # Optional storage engine (e.g. SqliteStore or DbJournal) that every
+        # edit is written through to
+        self._store = store
+
+        # Storage engine the DB was loaded from, which lazily loaded parts
+        # of the DB still read from (even without write through)
+        self._source_store = store
+
+        # Lazily built indexes of the scene map:
+        #  - offset -> (scene name, index in scene, TextCommand)
+        #  - JP hash -> [(scene name, index in scene, TextCommand)]
+        # Edits never touch the scene map, so once built they stay valid for
+        # the lifetime of the DB.
+        self._command_by_offset = None
+        self._commands_by_hash = None
+        self._shared_offset_scenes = None
+
+        # Lazily built translation progress counters, kept up to date by the
+        # mutation methods once built:
+        #  - number of translated content-addressed lines
+        #  - scene name -> [translated commands, total commands], taking
+        #    overrides into account
+        self._translated_line_count = None
+        self._scene_progress = None
+
+        # Cache of rendered (linebroken) scenes, scene name -> offset ->
+        # string, along with the settings they were rendered with. Edits
+        # drop the scenes they affect, which then count as dirty.
+        self._rendered_scenes = {}
+        self._render_settings = None
+
+        # Cache of individually rendered lines, shared by all scenes
+        self._line_render_cache = TranslationDb.LineRenderCache()
+
+    def store(self):
+        return self._store
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+        if self._source_store not in (None, self._store):
+            self._source_store.close()
+        self._store = None
+        self._source_store = None
+
+    def edit_batch(self):
+        # Context manager grouping several edits into a single write to the
+        # backing store, if there is one
+        if self._store is None:
+            return contextlib.nullcontext()
+        return self._store.batch()
+
     def scene_names(self, include_empty=False):
         all_scenes = list(self._scene_map.keys())
         if include_empty:
@@ -59,21 +141,82 @@ class TranslationDb:
         return self._overrides_by_offset.get(offset)
 
     def set_translation_and_comment_for_hash(self, jp_hash, en_text, comment):
+        was_translated = bool(self._line_by_hash[jp_hash].en_text)
         self._line_by_hash[jp_hash].en_text = en_text
         self._line_by_hash[jp_hash].comment = comment
+        if self._store is not None:
+            self._store.put_line(jp_hash, self._line_by_hash[jp_hash])
+
+        self._update_line_progress(jp_hash, was_translated, bool(en_text))
+        if self._rendered_scenes:
+            self.invalidate_rendered_scenes(self.scenes_for_hash(jp_hash))
 
     def tl_line_for_cmd(self, cmd):
         return self.tl_override_for_offset(cmd.offset) or \
             self.tl_line_with_hash(cmd.jp_hash)
 
-    def tl_line_for_offset(self, offset):
-        # Not a hot path, so just iterate the scene map
-        for scene in self._scene_map.values():
-            for line in scene:
-                if line.offset == offset:
-                    return line.jp_hash
+    def _build_command_indexes(self):
+        if self._command_by_offset is not None:
+            return
+
+        command_by_offset = {}
+        commands_by_hash = {}
+        shared_offset_scenes = {}
+        for scene_name, commands in self._scene_map.items():
+            for i, cmd in enumerate(commands):
+                entry = (scene_name, i, cmd)
+                commands_by_hash.setdefault(cmd.jp_hash, []).append(entry)
+                if cmd.offset not in command_by_offset:
+                    command_by_offset[cmd.offset] = entry
+                    continue
+
+                # Offsets are very rarely used by more than one scene, so
+                # only track the extra scenes for those that are
+                shared_offset_scenes.setdefault(
+                    cmd.offset, [command_by_offset[cmd.offset][0]]
+                ).append(scene_name)
+
+        self._command_by_offset = command_by_offset
+        self._commands_by_hash = commands_by_hash
+        self._shared_offset_scenes = shared_offset_scenes
+
+    def command_for_offset(self, offset):
+        # Returns (scene name, index in scene, TextCommand) for the command
+        # at offset, or None if no scene references it
+        self._build_command_indexes()
+        return self._command_by_offset.get(offset)
+
+    def scenes_for_offset(self, offset):
+        # Names of the scenes that use the line at offset
+        self._build_command_indexes()
+        if offset in self._shared_offset_scenes:
+            return list(self._shared_offset_scenes[offset])
+        entry = self._command_by_offset.get(offset)
+        return [entry[0]] if entry else []
+
+    def commands_for_hash(self, jp_hash):
+        # All TextCommands that emit the line with this hash, in scene order
+        self._build_command_indexes()
+        return [
+            cmd for _, _, cmd in self._commands_by_hash.get(jp_hash, [])
+        ]
+
+    def usage_count(self, jp_hash):
+        self._build_command_indexes()
+        return len(self._commands_by_hash.get(jp_hash, []))
+
+    def scenes_for_hash(self, jp_hash):
+        # Names of the scenes that use the line with this hash
+        self._build_command_indexes()
+        return list(dict.fromkeys(
+            scene_name
+            for scene_name, _, _ in self._commands_by_hash.get(jp_hash, [])
+        ))
 
-        return None
+    def tl_line_for_offset(self, offset):
+        # Returns the JP hash of the line at offset
+        entry = self.command_for_offset(offset)
+        return entry[2].jp_hash if entry else None
 
     def override_translation_and_comment_for_offset(
             self, offset, en_text, comment):
@@ -84,30 +227,103 @@ class TranslationDb:
             if jp_hash not in self._line_by_hash:
                 print(f"Unknown hash {jp_hash}")
                 return
-            base = copy.deepcopy(self._line_by_hash[jp_hash])
+            # The JP text is immutable, so share it with the base line
+            base_line = self._line_by_hash[jp_hash]
+            base = self.TLLine(
+                base_line.jp_text, base_line.en_text, base_line.comment)
             self._overrides_by_offset[offset] = base
 
+        # New overrides start out as a copy of the line they replace, so this
+        # is also whether the offset was translated before the edit
+        was_translated = bool(self._overrides_by_offset[offset].en_text)
         self._overrides_by_offset[offset].en_text = en_text
         self._overrides_by_offset[offset].comment = comment
+        if self._store is not None:
+            self._store.put_override(
+                offset, self._overrides_by_offset[offset])
+
+        # Only the scenes using the offset are affected, once per use
+        delta = bool(en_text) - was_translated
+        if delta and self._scene_progress is not None:
+            jp_hash = self.tl_line_for_offset(offset)
+            for scene_name, _, cmd in self._commands_by_hash.get(jp_hash, []):
+                if cmd.offset == offset:
+                    self._scene_progress[scene_name][0] += delta
+        if self._rendered_scenes:
+            self.invalidate_rendered_scenes(self.scenes_for_offset(offset))
 
     def clear_offset_overrides(self):
+        if self._rendered_scenes:
+            for offset in self._overrides_by_offset:
+                self.invalidate_rendered_scenes(
+                    self.scenes_for_offset(offset))
+
         self._overrides_by_offset = {}
+        if self._store is not None:
+            self._store.clear_overrides()
 
-    def translated_percent(self):
-        total_lines = 0
-        translated_lines = 0
-        for line in self._line_by_hash.values():
-            total_lines += 1
-            if line.en_text:
-                translated_lines += 1
+        # Any scene may have had overrides, so just recount when needed
+        self._scene_progress = None
 
-        return float(translated_lines) * 100.0 / float(total_lines)
+    def _update_line_progress(self, jp_hash, was_translated, is_translated):
+        delta = is_translated - was_translated
+        if not delta:
+            return
+
+        if self._translated_line_count is not None:
+            self._translated_line_count += delta
+
+        # Every use of the line in a scene counts, unless it is overridden
+        if self._scene_progress is not None:
+            self._build_command_indexes()
+            for scene_name, _, cmd in self._commands_by_hash.get(jp_hash, []):
+                if cmd.offset not in self._overrides_by_offset:
+                    self._scene_progress[scene_name][0] += delta
+
+    def translation_progress(self, scene_name=None):
+        # Progress of the whole DB (over the distinct content-addressed
+        # lines), or of a single scene (over its commands, with overrides)
+        if scene_name is None:
+            if self._translated_line_count is None:
+                self._translated_line_count = sum(
+                    1 for line in self._line_by_hash.values()
+                    if line.en_text
+                )
+            return TranslationDb.Progress(
+                self._translated_line_count, len(self._line_by_hash))
+
+        if self._scene_progress is None:
+            self._scene_progress = {
+                name: [
+                    sum(
+                        1 for cmd in commands
+                        if self.tl_line_for_cmd(cmd).en_text
+                    ),
+                    len(commands)
+                ]
+                for name, commands in self._scene_map.items()
+            }
+        return TranslationDb.Progress(*self._scene_progress[scene_name])
+
+    def translated_percent(self):
+        return self.translation_progress().percent()
 
     def get_charswap_map(self):
         return self._charswap_map
 
     def set_charswap_map(self, swap_map):
         self._charswap_map = swap_map
+        self.invalidate_rendered_scenes()
+        self._line_render_cache.clear()
+        if self._store is not None:
+            self._store.put_charswap_map(swap_map)
+
+    def contents(self):
+        # Raw DB contents, for use by serializers
+        return (
+            self._scene_map, self._line_by_hash, self._overrides_by_offset,
+            self._charswap_map
+        )
 
     def as_json(self):
         return json.dumps({
@@ -138,6 +354,13 @@ class TranslationDb:
             int(k): cls.TLLine.from_json(v)
             for k, v in jsonb.get('override_by_offset', {}).items()
         }
+
+        # Share the JP text of overrides with the lines they override
+        for override in overrides_by_offset.values():
+            base_line = line_by_hash.get(override.content_hash())
+            if base_line is not None:
+                override.jp_text = base_line.jp_text
+
         charswap_map = jsonb.get('charswap_map')
 
         return cls(scene_map, line_by_hash, overrides_by_offset, charswap_map)
@@ -180,24 +403,203 @@ class TranslationDb:
                 ).encode('utf-8')
             )
 
-    def generate_script_text_mrg(self, perform_charswap=False):
-        offset_to_string = self.generate_linebroken_text_map(perform_charswap)
+    def generate_script_text_mrg(self, perform_charswap=False, jobs=1):
+        offset_to_string = self.generate_linebroken_text_map(
+            perform_charswap, jobs=jobs)
         return self.pack_linebroken_text_to_mrg(offset_to_string)
 
-    def generate_linebroken_text_map(self, perform_charswap=False):
+    def write_script_text_mrg(self, output, perform_charswap=False, jobs=1):
+        # Like generate_script_text_mrg, but stream the MZP straight to a
+        # path or file object instead of building it in memory
+        offset_to_string = self.generate_linebroken_text_map(
+            perform_charswap, jobs=jobs)
+        Mzp.write(output, self.linebroken_text_sections(offset_to_string))
+
+    def generate_linebroken_text_map(self, perform_charswap=False,
+                                     force_full=False, jobs=1):
         # Iterate each scene in the translation DB, apply line breaking
         # and control codes and stick the result into a map of offset -> string
+        # Scenes are rendered independently, and the result for each is
+        # cached until one of the lines it uses is edited. force_full
+        # discards all cached results first.
+        # jobs controls the number of rendering processes. None uses one per
+        # CPU, 1 renders everything in this process.
+        if force_full:
+            self.invalidate_rendered_scenes()
+        self._render_dirty_scenes(perform_charswap, jobs)
+
+        # Scenes are merged in order, so later scenes win for any offset
+        # that is used more than once, same as rendering them in sequence
         offset_to_string = {}
+        for scene_name in self._scene_map:
+            offset_to_string.update(self._rendered_scenes[scene_name])
+
+        return offset_to_string
+
+    def check_render(self, perform_charswap=False, jobs=1):
+        # Dry run of generate_linebroken_text_map that collects every line
+        # that fails to render, rather than stopping at the first one.
+        # Scenes that render cleanly are kept for the next inject. Returns
+        # a list of RenderProblems, in script order.
+        problems = []
+        self._render_dirty_scenes(perform_charswap, jobs, problems)
+        return problems
+
+    def _render_dirty_scenes(self, perform_charswap, jobs, problems=None):
+        # Render every scene without a cached result. With problems, scenes
+        # that fail are recorded there (see _render_scene) and stay dirty.
+        render_settings = (perform_charswap, RubyUtils.ENABLE_PUA_CODES)
+        if render_settings != self._render_settings:
+            self.invalidate_rendered_scenes()
+            self._render_settings = render_settings
+
+        dirty_scenes = self.dirty_scenes()
+        jobs = jobs or multiprocessing.cpu_count()
+        if jobs != 1 and len(dirty_scenes) >= 2:
+            self._render_scenes_in_pool(
+                dirty_scenes, perform_charswap, jobs, problems)
+            return
+
+        for scene_name in dirty_scenes:
+            scene_problems = None if problems is None else []
+            rendered = self._render_scene(
+                scene_name, self._scene_map[scene_name], perform_charswap,
+                scene_problems)
+            if scene_problems:
+                problems.extend(scene_problems)
+            else:
+                self._rendered_scenes[scene_name] = rendered
+
+    def _render_scenes_in_pool(self, scene_names, perform_charswap, jobs,
+                               problems=None):
+        # Each task carries just the lines its scene uses
+        tasks = []
+        for scene_name in scene_names:
+            commands = self._scene_map[scene_name]
+            tasks.append((
+                scene_name,
+                commands,
+                {
+                    cmd.jp_hash: self._line_by_hash[cmd.jp_hash]
+                    for cmd in commands
+                },
+                {
+                    cmd.offset: self._overrides_by_offset[cmd.offset]
+                    for cmd in commands
+                    if cmd.offset in self._overrides_by_offset
+                },
+            ))
+
+        with multiprocessing.Pool(
+                min(jobs, len(tasks)),
+                initializer=TranslationDb.SceneRenderer.init_worker,
+                initargs=(
+                    self._charswap_map, perform_charswap,
+                    RubyUtils.ENABLE_PUA_CODES,
+                    problems is not None)) as pool:
+            # Results come back in scene order, so the first error raised
+            # here is the first one in the DB
+            for scene_name, (rendered, scene_problems, hits, misses) in zip(
+                    scene_names, pool.imap(
+                        TranslationDb.SceneRenderer.render_in_worker, tasks)):
+                if scene_problems:
+                    problems.extend(scene_problems)
+                else:
+                    self._rendered_scenes[scene_name] = rendered
+                self._line_render_cache.hits += hits
+                self._line_render_cache.misses += misses
+
+    def invalidate_rendered_scenes(self, scene_names=None):
+        # Drop cached scene renders, for the given scenes or all of them
+        if scene_names is None:
+            self._rendered_scenes = {}
+            return
+
+        for scene_name in scene_names:
+            self._rendered_scenes.pop(scene_name, None)
+
+    def dirty_scenes(self):
+        # Scenes that the next generate_linebroken_text_map has to render
+        return [
+            scene_name for scene_name in self._scene_map
+            if scene_name not in self._rendered_scenes
+        ]
 
-        for scene_name, scene_commands in self._scene_map.items():
-            cursor_position = 0
-            prev_page_number = None
-            scene_is_qa = scene_name.startswith('QA')
-            # We need some amount of lookahead for glue lines, so iterate
-            # by offset here
-            for cmd_offset in range(len(scene_commands)):
-                command = scene_commands[cmd_offset]
+    def _render_line(self, tl_text, cursor_position, scene_is_qa,
+                     follows_newline, perform_charswap):
+        # Apply control codes to a single line and break it, starting from
+        # cursor_position. Returns the broken text, whether it was broken,
+        # the final line of it, and the resulting cursor position.
+
+        # Before processing the line for control codes, check to
+        # see if it has any flags we care about here
+        skip_linebreak = '%{no_break}' in tl_text
+
+        # Reify any custom control codes present in the line
+        coded_text = RubyUtils.apply_control_codes(tl_text)
+
+        # If we are performing a charswap, do so now
+        if perform_charswap:
+            coded_text = ''.join([
+                self._charswap_map.get(c, c) for c in coded_text
+            ])
+
+        # If this line is glued, and would start with a space, but the
+        # preceding line ended in a newline, drop the leading space.
+        if coded_text and follows_newline and coded_text[0] == ' ':
+            coded_text = coded_text[1:]
+
+        # Break the text, unless this is a QA scene in which case
+        # it's all manual
+        linebroken_text = (
+            coded_text if (scene_is_qa or skip_linebreak) else
+            RubyUtils.linebreak_text(
+                coded_text,
+                Constants.CHARS_PER_LINE,
+                start_cursor_pos=cursor_position
+            )
+        )
+
+        # Check if the broken text contains any newlines, and update
+        # the new cursor position accordingly
+        did_break_line = len(linebroken_text.split('\n')) > 1
+        final_broken_line = linebroken_text.split('\n')[-1]
+        if did_break_line:
+            cursor_position = RubyUtils.noruby_len(final_broken_line)
+        else:
+            cursor_position += RubyUtils.noruby_len(final_broken_line)
+
+        # Wrap the cursor position if necessary
+        cursor_position = \
+            cursor_position % Constants.CHARS_PER_LINE
+
+        return (
+            linebroken_text, did_break_line, final_broken_line,
+            cursor_position
+        )
+
+    def line_render_cache(self):
+        # The LineRenderCache used when rendering scenes, e.g. for hit rate
+        # statistics
+        return self._line_render_cache
+
+    def _render_scene(self, scene_name, scene_commands, perform_charswap,
+                      problems=None):
+        # Render a single scene to a map of offset -> string. The cursor and
+        # glue state never carries over between scenes.
+        # If problems is a list, each line that fails to render is recorded
+        # there as a RenderProblem and rendering carries on with the next
+        # one. Otherwise the first failure is raised.
+        offset_to_string = {}
+        cursor_position = 0
+        prev_page_number = None
+        scene_is_qa = scene_name.startswith('QA')
+        # We need some amount of lookahead for glue lines, so iterate
+        # by offset here
+        for cmd_offset in range(len(scene_commands)):
+            command = scene_commands[cmd_offset]
 
+            try:
                 # Pull the translated text for this line from the SHA-addressed
                 # translation table
                 tl_line = self._line_by_hash[command.jp_hash]
@@ -235,55 +637,34 @@ class TranslationDb:
                     prev_page_number = command.page_number
                     cursor_position = 0
 
-                # Before processing the line for control codes, check to
-                # see if it has any flags we care about here
-                skip_linebreak = '%{no_break}' in tl_text
-
-                # Reify any custom control codes present in the line
-                coded_text = RubyUtils.apply_control_codes(tl_text)
-
-                # If we are performing a charswap, do so now
-                if perform_charswap:
-                    coded_text = ''.join([
-                        self._charswap_map.get(c, c) for c in coded_text
-                    ])
-
                 # If this line is glued, and would start with a space, but the
-                # preceding line ended in a newline, drop the leading space.
-                if coded_text and command.is_glued and cmd_offset - 1 >= 0:
+                # preceding line ended in a newline, the space gets dropped
+                follows_newline = False
+                if command.is_glued and cmd_offset - 1 >= 0:
                     prev_cmd = scene_commands[cmd_offset-1]
                     # Need to strip the padding \r\n from lines
                     prev_broken_line = offset_to_string[
                         prev_cmd.offset].replace("\r\n", "")
-                    if prev_broken_line and \
-                       prev_broken_line[-1] == '\n' and \
-                       coded_text[0] == ' ':
-                        coded_text = coded_text[1:]
-
-                # Break the text, unless this is a QA scene in which case
-                # it's all manual
-                linebroken_text = (
-                    coded_text if (scene_is_qa or skip_linebreak) else
-                    RubyUtils.linebreak_text(
-                        coded_text,
-                        Constants.CHARS_PER_LINE,
-                        start_cursor_pos=cursor_position
-                    )
+                    follows_newline = bool(prev_broken_line) and \
+                        prev_broken_line[-1] == '\n'
+
+                # Apply control codes and break the line. This only depends on
+                # the text, the cursor position and a few flags, and many lines
+                # repeat, so go through the line render cache.
+                line_key = (
+                    tl_text, cursor_position, scene_is_qa, follows_newline,
+                    perform_charswap, RubyUtils.ENABLE_PUA_CODES
                 )
+                rendered_line = self._line_render_cache.get(line_key)
+                if rendered_line is None:
+                    rendered_line = self._render_line(
+                        tl_text, cursor_position, scene_is_qa, follows_newline,
+                        perform_charswap)
+                    self._line_render_cache.put(line_key, rendered_line)
 
-                # Check if the broken text contains any newlines, and update
-                # the new cursor position accordingly
-                did_break_line = len(linebroken_text.split('\n')) > 1
-                final_broken_line = linebroken_text.split('\n')[-1]
                 old_cursor_position = cursor_position
-                if did_break_line:
-                    cursor_position = RubyUtils.noruby_len(final_broken_line)
-                else:
-                    cursor_position += RubyUtils.noruby_len(final_broken_line)
-
-                # Wrap the cursor position if necessary
-                cursor_position = \
-                    cursor_position % Constants.CHARS_PER_LINE
+                (linebroken_text, did_break_line, final_broken_line,
+                 cursor_position) = rendered_line
 
                 # Test to see if the next line is glued
                 if cmd_offset + 1 < len(scene_commands):
@@ -339,7 +720,8 @@ class TranslationDb:
                                 # line to find a natural break. We can't, so
                                 # crash here and force the editor to go put in
                                 # a manual %{n} or %{s} somewhere.
-                                raise RuntimeError(
+                                raise TranslationDb.SceneRenderError(
+                                    scene_name,
                                     f"Fixing glue for offset {command.offset} "
                                     "requires too much backtracking. "
                                     "Insert extra whitespace to allow first "
@@ -360,81 +742,223 @@ class TranslationDb:
 
                 # Stick the processed string into our map
                 offset_to_string[command.offset] = processed_string
+            except Exception as e:
+                if problems is None:
+                    raise
+
+                problems.append(TranslationDb.RenderProblem(
+                    scene_name, command.offset, command.jp_hash,
+                    e.message if isinstance(
+                        e, TranslationDb.SceneRenderError)
+                    else f"{type(e).__name__}: {e}"
+                ))
+
+                # Carry on with the JP text in place of the broken line
+                jp_line = self._line_by_hash.get(command.jp_hash)
+                offset_to_string[command.offset] = \
+                    jp_line.jp_text if jp_line is not None else ''
+                cursor_position = 0
 
         return offset_to_string
 
-    def pack_linebroken_text_to_mrg(self, offset_to_string):
+    def patch_script_text_mrg(self, path, perform_charswap=False, jobs=1):
+        # Inject the translation into an existing script_text MZP in place,
+        # only rewriting the sections that actually change. Returns the
+        # indices of the rewritten sections.
+        offset_to_string = self.generate_linebroken_text_map(
+            perform_charswap, jobs=jobs)
+        return self._patch_sections(
+            path, self.linebroken_text_sections(offset_to_string))
+
+    @staticmethod
+    def _patch_sections(path, sections):
+        # Work out which sections differ. The mapping has to be closed
+        # before the file is modified.
+        try:
+            with Mzp(path) as existing:
+                if len(existing.data) != len(sections):
+                    changed = None
+                else:
+                    changed = [
+                        i for i, section in enumerate(sections)
+                        if existing.data[i] != section
+                    ]
+        except (OSError, ValueError, AssertionError):
+            # Missing, empty or damaged, e.g. by an interrupted write
+            changed = None
+
+        # Different layout entirely, so just rewrite the whole thing
+        if changed is None:
+            Mzp.write(path, sections)
+            return list(range(len(sections)))
+
+        Mzp.patch(path, {i: sections[i] for i in changed})
+        return changed
+
+    def inject_incremental(self, path, perform_charswap=False, jobs=1):
+        # Inject the translation into the script_text MZP at path, reusing
+        # the output of the previous inject_incremental to that path. Only
+        # scenes whose lines changed since then are rendered again, and if
+        # nothing changed the MZP is not touched at all. Without a usable
+        # manifest from the previous run (or without an MZP at path) every
+        # scene not already rendered in this process is rendered. Returns
+        # the names of the rendered scenes.
+        settings_digest = InjectManifest.digest_settings(
+            perform_charswap, RubyUtils.ENABLE_PUA_CODES, self._charswap_map)
+        scene_digests = {
+            scene_name: InjectManifest.digest_scene(
+                scene_name, commands, self.tl_line_for_cmd)
+            for scene_name, commands in self._scene_map.items()
+        }
+
+        manifest = InjectManifest.load(path)
+        previous_strings = None
+        if manifest is not None and \
+                manifest.settings_digest == settings_digest:
+            previous_strings = self._read_previous_strings(path, manifest)
+
+        render_settings = (perform_charswap, RubyUtils.ENABLE_PUA_CODES)
+        if render_settings != self._render_settings:
+            self.invalidate_rendered_scenes()
+            self._render_settings = render_settings
+
+        if previous_strings is not None:
+            if manifest.scene_digests == scene_digests:
+                return []
+
+            # Scenes that are unchanged get their previous output back, so
+            # only the rest need rendering
+            for scene_name, digest in scene_digests.items():
+                if scene_name in self._rendered_scenes or \
+                        manifest.scene_digests.get(scene_name) != digest:
+                    continue
+                self._rendered_scenes[scene_name] = {
+                    cmd.offset: previous_strings.get(cmd.offset, '')
+                    for cmd in self._scene_map[scene_name]
+                }
+
+        rendered_scenes = self.dirty_scenes()
+        offset_to_string = self.generate_linebroken_text_map(
+            perform_charswap, jobs=jobs)
+        sections = self.linebroken_text_sections(offset_to_string)
+        self._patch_sections(path, sections)
+
+        # Written after the MZP, so that a crash in between leaves a
+        # manifest that no longer matches, forcing a full inject next time
+        InjectManifest(
+            settings_digest,
+            scene_digests,
+            [
+                offset for offset in range(max(offset_to_string) + 1)
+                if offset_to_string.get(offset)
+            ],
+            InjectManifest.digest_tables(sections[0], sections[1])
+        ).save(path)
+
+        return rendered_scenes
+
+    def _read_previous_strings(self, path, manifest):
+        # Map of offset -> string as written to path along with manifest, or
+        # None if the MZP has been changed since
+        try:
+            with Mzp(path) as mzp:
+                if len(mzp.data) < 2:
+                    return None
+                offset_table = bytes(mzp.data[0])
+                string_table = bytes(mzp.data[1])
+        except (OSError, ValueError, AssertionError):
+            return None
+
+        if not manifest.matches_tables(offset_table, string_table):
+            return None
+
+        ranges = self.string_table_ranges(offset_table)
+        if len(ranges) != len(manifest.offsets):
+            return None
+
+        return {
+            offset: str(string_table[data_start:data_end], 'utf-8')
+            for offset, (_, data_start, data_end)
+            in zip(manifest.offsets, ranges)
+        }
+
+    def pack_linebroken_text_to_mrg(self, offset_to_string, pool=False):
+        return Mzp.pack(
+            self.linebroken_text_sections(offset_to_string), pool=pool)
+
+    def verify_script_text_mrg(self, source, offset_to_string):
+        # Decode a script_text MZP (path or buffer) the same way from_mrg
+        # does, and check that it holds exactly offset_to_string. Returns a
+        # list of problems, empty if the archive is good.
+        problems = []
+        with Mzp(source) as mzp:
+            sections = [bytes(section) for section in mzp.data]
+
+        if len(sections) != 10:
+            return [f"Expected 10 sections, found {len(sections)}"]
+
+        max_offset = max(offset_to_string.keys())
+        expected = [
+            (offset, offset_to_string[offset])
+            for offset in range(max_offset + 1)
+            if offset_to_string.get(offset)
+        ]
+        ranges = self.string_table_ranges(sections[0])
+        if len(ranges) != len(expected):
+            problems.append(
+                f"Expected {len(expected)} strings, found {len(ranges)}")
+
+        for (offset, string), (_, data_start, data_end) in zip(
+                expected, ranges):
+            decoded = str(sections[1][data_start:data_end], 'utf-8')
+            if decoded != string:
+                problems.append(
+                    f"Offset {offset}: expected {string!r}, found {decoded!r}")
+
+        # The padding tables have to decode the same way as well
+        padding_tables = self._padding_tables(max_offset)
+        padding_sections = list(padding_tables[:2]) + \
+            list(padding_tables[2:]) * 3
+        for i, (section, expected_section) in enumerate(
+                zip(sections[2:], padding_sections), start=2):
+            if section != expected_section:
+                problems.append(f"Padding section {i} does not match")
+
+        return problems
+
+    def linebroken_text_sections(self, offset_to_string):
         # Now that we have processed all the strings, iterate from 0 to
-        # max_offset and write each string entry into an MZP.
+        # max_offset and pack each string entry into the tables of an MZP.
         max_offset = max(offset_to_string.keys())
-        offset_table = io.BytesIO()
-        string_table = io.BytesIO()
-        for offset in range(max_offset + 1):
-            # There are a handful of null strings that mark EOF
-            # Just write FFs to the offset table, no string data for these
-            if not offset_to_string.get(offset, ''):
-                continue
 
-            # Write the offset of this string to the offset table
-            offset_table.write(struct.pack(">I", string_table.tell()))
-
-            # Write the string data to the string table
-            string_table.write(
-                offset_to_string.get(offset, '').encode('utf-8'))
+        # There are a handful of null strings that mark EOF. These get no
+        # entry in the offset table, and no string data.
+        encoded_strings = [
+            string.encode('utf-8') for string in (
+                offset_to_string.get(offset, '')
+                for offset in range(max_offset + 1)
+            ) if string
+        ]
 
-        # Finalize the offset table by writing the final offset twice,
-        # followed by 12 bytes of 0xFF
-        offset_table.write(struct.pack(">I", string_table.tell()))
-        offset_table.write(struct.pack(">I", string_table.tell()))
-        offset_table.write(struct.pack(">I", 0xFFFFFFFF))
+        # Each string starts where the previous one ended. Finalize the
+        # offset table by writing the final offset twice, followed by 4
+        # bytes of 0xFF
+        string_offsets = array.array('I', itertools.accumulate(
+            map(len, encoded_strings), initial=0))
+        string_offsets.extend([string_offsets[-1], 0xFFFFFFFF])
 
-        offset_table.seek(0, io.SEEK_SET)
-        string_table.seek(0, io.SEEK_SET)
-        offset_table_str = offset_table.read()
-        string_table_str = string_table.read()
+        offset_table_str = self._pack_offset_table(string_offsets)
+        string_table_str = b''.join(encoded_strings)
 
         # For whatever reason, the MZP also contains 4 offset/string table
-        # pairs consisting of just '  \r\n' . Regenerate these tables too
-        # in case they actually mean something.
-        newline_offset_table = io.BytesIO()
-        newline_string_table = io.BytesIO()
-        for i in range(max_offset + 1):
-            newline_offset_table.write(
-                struct.pack(">I", newline_string_table.tell()))
-            newline_string_table.write(b"  \r\n")
-
-        # Finalize
-        newline_string_table_end = newline_string_table.tell()
-        newline_offset_table.write(struct.pack(">I", newline_string_table_end))
-        newline_offset_table.write(struct.pack(">I", newline_string_table_end))
-        newline_offset_table.write(struct.pack(">I", 0xFFFFFFFF))
-
-        newline_offset_table.seek(0, io.SEEK_SET)
-        newline_string_table.seek(0, io.SEEK_SET)
-        newline_offset_table_str = newline_offset_table.read()
-        newline_string_table_str = newline_string_table.read()
-
-        # Space tables
-        space_offset_table = io.BytesIO()
-        space_string_table = io.BytesIO()
-        for i in range(max_offset + 1):
-            space_offset_table.write(
-                struct.pack(">I", space_string_table.tell()))
-            space_string_table.write("\u3000\r\n".encode('utf-8'))
-
-        # Finalize
-        space_string_table_end = space_string_table.tell()
-        space_offset_table.write(struct.pack(">I", space_string_table_end))
-        space_offset_table.write(struct.pack(">I", space_string_table_end))
-        space_offset_table.write(struct.pack(">I", 0xFFFFFFFF))
-
-        space_offset_table.seek(0, io.SEEK_SET)
-        space_string_table.seek(0, io.SEEK_SET)
-        space_offset_table_str = space_offset_table.read()
-        space_string_table_str = space_string_table.read()
-
-        # Pack the MZP
-        return Mzp.pack([
+        # pairs consisting of just '  \r\n' or '\u3000\r\n'. Regenerate these
+        # tables too in case they actually mean something.
+        (newline_offset_table_str, newline_string_table_str,
+         space_offset_table_str, space_string_table_str) = \
+            self._padding_tables(max_offset)
+
+        # Sections of the MZP
+        return [
             # Actual translation data
             offset_table_str, string_table_str,
             # 4 copies of newlines
@@ -442,17 +966,71 @@ class TranslationDb:
             space_offset_table_str, space_string_table_str,
             space_offset_table_str, space_string_table_str,
             space_offset_table_str, space_string_table_str,
-        ])
+        ]
+
+    @staticmethod
+    def _pack_offset_table(string_offsets):
+        # Offset tables are big endian u32s
+        packed = array.array('I', string_offsets)
+        if sys.byteorder == 'little':
+            packed.byteswap()
+        return packed.tobytes()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4)
+    def _padding_tables(max_offset):
+        # The padding tables only depend on the number of offsets, so only
+        # build them once
+        tables = []
+        for string in ("  \r\n", "\u3000\r\n"):
+            encoded = string.encode('utf-8')
+            string_offsets = array.array('I', range(
+                0, len(encoded) * (max_offset + 2), len(encoded)))
+            string_offsets.extend([string_offsets[-1], 0xFFFFFFFF])
+            tables.append(TranslationDb._pack_offset_table(string_offsets))
+            tables.append(encoded * (max_offset + 1))
+
+        return tuple(tables)
 
     @classmethod
-    def from_file(cls, path):
-        with open(path, 'rb') as input_file:
-            raw_db = input_file.read()
-        return cls.from_json(json.loads(raw_db))
+    def from_file(cls, path, write_through=False):
+        # Work out which format the DB is stored in, and remember it so
+        # that saving the DB keeps the same format
+        db_format = DbFormats.detect_file(path)
+        db = db_format.load_file(cls, path)
+        db._db_format = db_format.NAME
+
+        # Snapshot formats have their edits journalled next to them. Replay
+        # any edits made since the snapshot was written.
+        store = db._store
+        db._store = None
+        journal = None
+        if store is None:
+            journal = DbJournal(DbJournal.path_for(path))
+            journal.replay(db)
+
+        # With write_through, every edit made from here on is persisted as
+        # it happens, by the storage format itself or by the journal.
+        # Otherwise edits are only kept by an explicit to_file.
+        if write_through:
+            db._store = store or journal
+
+        return db
+
+    def to_file(self, path, db_format=None):
+        # Save in the requested format, or the format the DB was loaded from.
+        # The new file holds every edit, so any journal for it is emptied.
+        DbFormats.by_name(db_format or self._db_format).save_file(self, path)
+        DbJournal.truncate_for(path)
+
+    def save(self, path):
+        # Routine save. If the backing store (e.g. the edit journal) already
+        # holds every edit for this path, there is nothing to write until
+        # it is due for compaction.
+        if self._store is not None and self._store.covers(path):
+            return
 
-    def to_file(self, path):
-        with open(path, 'wb+') as output:
-            output.write(self.as_json().encode('utf-8'))
+        self.to_file(path)
 
     def import_update_file(self, filename):
         # Parse diff
@@ -462,29 +1040,32 @@ class TranslationDb:
         self.apply_diff(diff)
 
     def apply_diff(self, diff):
-        for sha, entry_group in diff.entries_by_sha.items():
-            # Ignore entries with conflicts
-            if not entry_group.is_unique():
-                continue
+        # Apply everything as a single write to any backing store
+        with self.edit_batch():
+            for sha, entry_group in diff.entries_by_sha.items():
+                # Ignore entries with conflicts
+                if not entry_group.is_unique():
+                    continue
 
-            # Just directly apply non-conflicting diff items
-            self.set_translation_and_comment_for_hash(
-                sha,
-                entry_group.entries[0].en_text,
-                entry_group.entries[0].comment,
-            )
+                # Just directly apply non-conflicting diff items
+                self.set_translation_and_comment_for_hash(
+                    sha,
+                    entry_group.entries[0].en_text,
+                    entry_group.entries[0].comment,
+                )
 
-        for offset, entry_group in diff.entries_by_offset.items():
-            # If there's duplicate offset entries somehow, they gotta fix that
-            if not entry_group.is_unique():
-                continue
+            for offset, entry_group in diff.entries_by_offset.items():
+                # If there's duplicate offset entries somehow, they gotta fix
+                # that
+                if not entry_group.is_unique():
+                    continue
 
-            # Commit the override
-            self.override_translation_and_comment_for_offset(
-                offset,
-                entry_group.entries[0].en_text,
-                entry_group.entries[0].comment,
-            )
+                # Commit the override
+                self.override_translation_and_comment_for_offset(
+                    offset,
+                    entry_group.entries[0].en_text,
+                    entry_group.entries[0].comment,
+                )
 
     def parse_update_file(self, filename):
         # Try to parse it to a diff
@@ -548,67 +1129,132 @@ class TranslationDb:
             f"but scene expects {len(scene_lines)} lines."
 
         # Zip and update
-        for scene_line, (tl_text, comment_text) in zip(scene_lines, lines):
-            self.set_translation_and_comment_for_hash(
-                scene_line.jp_hash, tl_text, comment_text
-            )
+        with self.edit_batch():
+            for scene_line, (tl_text, comment_text) in zip(
+                    scene_lines, lines):
+                self.set_translation_and_comment_for_hash(
+                    scene_line.jp_hash, tl_text, comment_text
+                )
+
+    @staticmethod
+    def split_script_cmds(script):
+        # Split a script into stripped command strings. The script may be
+        # either the complete script data or an iterable of chunks of it, as
+        # produced by Mzx.decompress_iter. ';' can never appear inside a
+        # multi-byte UTF-8 sequence, so it is safe to split before decoding.
+        if isinstance(script, (bytes, bytearray, memoryview)):
+            script = [script]
+
+        remainder = b''
+        for chunk in script:
+            pieces = (remainder + bytes(chunk)).split(b';')
+            remainder = pieces.pop()
+            for piece in pieces:
+                cmd = piece.decode('utf-8').strip()
+                if cmd:
+                    yield cmd
+
+        cmd = remainder.decode('utf-8').strip()
+        if cmd:
+            yield cmd
 
     @classmethod
-    def parse_script_cmds(cls, script, strings_by_content_hash,
-                          content_hash_by_offset):
-        # Split script into commands
-        raw_cmds = [
-            cmd.strip() for cmd in script.decode('utf-8').split(';')
-            if cmd.strip()
-        ]
+    def scan_script_cmds(cls, script):
+        # Single pass over the raw script data for the commands that
+        # parse_script_cmds looks at (PGST, ZM*, MSAD and SELR), yielding
+        # (opcode, arguments) for each. The script may be the complete
+        # script data or an iterable of chunks of it, as produced by
+        # Mzx.decompress_iter, which is scanned as it arrives. Only a command
+        # straddling two chunks is held over.
+        # Commands are parsed straight from the bytes, and their arguments
+        # stay bytes. Only commands with non-ASCII text get decoded, and
+        # their arguments are str.
+        if isinstance(script, (bytes, bytearray, memoryview)):
+            script = [script]
+
+        remainder = b''
+        for chunk in script:
+            data = remainder + bytes(chunk)
+            # Only scan up to the end of the last complete command
+            cmds_end = data.rfind(b';') + 1
+            yield from cls._scan_cmds(data, cmds_end)
+            remainder = data[cmds_end:]
+
+        yield from cls._scan_cmds(remainder, len(remainder))
 
-        # Regex to parse command name/args
-        command_regex = re.compile(
-            r"_(\w+)\(([\w 　a-zA-Z0-9-,`@$:.+^_]*)\)\Z")
+    @classmethod
+    def _scan_cmds(cls, data, end):
+        cmd_end = 0
+        for prefix_match in cls.TEXT_CMD_PREFIX_REGEX.finditer(data, 0, end):
+            # Already handled the command this occurs in
+            if prefix_match.start() < cmd_end:
+                continue
 
-        # Parse each script command
-        script_commands = []
-        for cmd in raw_cmds:
-            # Try and match regex
-            match = command_regex.match(cmd)
+            # ';' can never appear inside a multi-byte UTF-8 sequence, so
+            # the command boundaries can be found before decoding
+            cmd_start = data.rfind(b';', 0, prefix_match.start()) + 1
+            cmd_end = data.find(b';', prefix_match.end(), end)
+            if cmd_end == -1:
+                cmd_end = end
+
+            cmd = data[cmd_start:cmd_end]
+            if cmd.isascii():
+                match = cls.SCRIPT_CMD_BYTES_REGEX.match(
+                    cmd.strip(cls.ASCII_WHITESPACE))
+                separator = b','
+            else:
+                cmd = cmd.decode('utf-8')
+                match = cls.SCRIPT_CMD_REGEX.match(cmd.strip())
+                separator = ','
             if not match:
-                sys.stderr.write(f"Failed to parse command {cmd}\n")
+                if isinstance(cmd, bytes):
+                    cmd = cmd.decode('ascii')
+                sys.stderr.write(f"Failed to parse command {cmd.strip()}\n")
                 continue
 
-            groups = match.groups()
-            script_commands.append(
-                cls.AllscrCmd(groups[0])
-                if len(groups) == 1
-                else cls.AllscrCmd(groups[0], groups[1].split(','))
-            )
+            opcode = match.group(1)
+            if isinstance(opcode, bytes):
+                opcode = opcode.decode('ascii')
+            if opcode in ('PGST', 'MSAD', 'SELR') or opcode.startswith('ZM'):
+                yield (opcode, match.group(2).split(separator))
 
-        # Now iterate the script commands and extract any that reference
+    @classmethod
+    def parse_script_cmds(cls, script, strings_by_content_hash,
+                          content_hash_by_offset):
+        # Iterate the script commands and extract any that reference
         # script lines
         text_offsets = []
         visited_offsets = set()
         page_number = 0
         seen_offsets = set()
-        for cmd in script_commands:
+        for (opcode, arguments) in cls.scan_script_cmds(script):
             # If it's a PGST, take argv0 the page counter
-            if cmd.opcode == 'PGST':
-                page_number = int(cmd.arguments[0])
+            if opcode == 'PGST':
+                page_number = int(arguments[0])
                 continue
 
-            # If it's not a text scripting command, ignore
-            is_zm = cmd.opcode.startswith('ZM')
-            is_msad = cmd.opcode == 'MSAD'
-            is_selr = cmd.opcode == 'SELR'
-            if not any([is_zm, is_msad, is_selr]):
-                continue
+            # Anything else is a text scripting command
+            is_msad = opcode == 'MSAD'
+            is_selr = opcode == 'SELR'
 
             # If it has no arguments, ignore
-            if not cmd.arguments:
+            if not arguments:
                 continue
 
-            # If it does have args, match all instances of text references
-            for arg in cmd.arguments:
-                text_refs = re.compile(r"(\$\d+)").findall(arg)
-                text_modifiers = re.compile(r"(\@\w)").findall(arg)
+            # If it does have args, match all instances of text references.
+            # Arguments of ASCII-only commands are still bytes.
+            for arg in arguments:
+                if isinstance(arg, bytes):
+                    text_refs = cls.TEXT_REF_BYTES_REGEX.findall(arg)
+                    text_modifiers = [
+                        modifier.decode('ascii') for modifier in
+                        cls.TEXT_MODIFIER_BYTES_REGEX.findall(arg)
+                    ]
+                    (dollar, caret) = (b'$', b'^')
+                else:
+                    text_refs = cls.TEXT_REF_REGEX.findall(arg)
+                    text_modifiers = cls.TEXT_MODIFIER_REGEX.findall(arg)
+                    (dollar, caret) = ('$', '^')
                 offsets = [int(ref[1:]) for ref in text_refs]
                 for offset in offsets:
                     # If we already saw this offset in the file, just skip
@@ -618,11 +1264,14 @@ class TranslationDb:
                     # Does this offset have a forced linebreak after it?
                     # Get the position of the offset in the full cmd line
                     fmt_off = f"${offset:06}"
+                    if isinstance(arg, bytes):
+                        fmt_off = fmt_off.encode('ascii')
                     offset_pos = arg.find(fmt_off)
                     # If there is a ^ between this offset and the $ of a
                     # subsequent offset, we have a trailing newline.
-                    next_offset_pos = arg.find("$", offset_pos + len(fmt_off))
-                    caret_pos = arg.find("^", offset_pos, next_offset_pos)
+                    next_offset_pos = arg.find(
+                        dollar, offset_pos + len(fmt_off))
+                    caret_pos = arg.find(caret, offset_pos, next_offset_pos)
                     has_forced_newline = caret_pos != -1
 
                     # Work out whether this line is glued to the previous
@@ -667,31 +1316,48 @@ class TranslationDb:
 
         return text_offsets
 
+    @staticmethod
+    def string_table_ranges(string_offsets_raw):
+        # Decode a script text offset table into a list of
+        # (offset, data_start, data_end) for each string in the string table.
+        # Each string runs up to the start of the next one, and a zero-length
+        # string marks the end of the table.
+        string_offsets = array.array('I', bytes(
+            string_offsets_raw[:len(string_offsets_raw) // 4 * 4]))
+        if sys.byteorder == 'little':
+            string_offsets.byteswap()
+
+        ranges = []
+        for i in range(len(string_offsets) - 1):
+            data_start = string_offsets[i]
+            data_end = string_offsets[i + 1]
+            if data_start == data_end:
+                break
+            ranges.append((i, data_start, data_end))
+
+        return ranges
+
     @classmethod
-    def from_mrg(cls, allscr_path, script_text_path):
-        script_text_mzp = Mzp(script_text_path)
+    def from_mrg(cls, allscr_path, script_text_path, jobs=None, cache=None):
+        # jobs controls the number of extraction processes. None uses one
+        # per CPU, 1 extracts everything in this process.
+        # If a SceneCache is given, previously parsed scenes are read from
+        # it instead of being extracted again.
+        jobs = jobs or multiprocessing.cpu_count()
 
         # First script text MZP entry is the string offsets, second is
         # the string data
-        string_offsets_raw = script_text_mzp.data[0]
-        string_table_raw = script_text_mzp.data[1]
+        with Mzp(script_text_path) as script_text_mzp:
+            string_offsets_raw = bytes(script_text_mzp.data[0])
+            string_table_raw = bytes(script_text_mzp.data[1])
 
         # For each 32 bit offset in the offset table, extract the associated
         # JP text
-        offset_count = len(string_offsets_raw) // 4
         strings_by_offset = {}
-        for i in range(offset_count):
-            (data_start,) = struct.unpack('>I', string_offsets_raw[i*4:i*4+4])
-            (data_end,) = struct.unpack(
-                '>I', string_offsets_raw[(i+1)*4:(i+1)*4+4])
-
-            # Zero-len string marks end of offset table
-            if data_start == data_end:
-                break
-
-            # If it's non-zero, extract the associated string data
+        for i, data_start, data_end in cls.string_table_ranges(
+                string_offsets_raw):
             data = string_table_raw[data_start:data_end]
-            strings_by_offset[i] = data.decode('utf-8')
+            strings_by_offset[i] = str(data, 'utf-8')
 
         # Hash those strings to build initial content table and
         # offset -> hash table
@@ -703,37 +1369,86 @@ class TranslationDb:
             strings_by_content_hash[tl_line.content_hash()] = tl_line
 
         # Parse the scene map from allscr
-        allscr_mzp = Mzp(allscr_path)
-
-        # Zeroth entry is the script filenames. Each 32 byte chunk is one
-        # string, delete excess \0 chars and arrayize
-        script_nam_raw = allscr_mzp.data[0]
-        script_names = [
-            script_nam_raw[i:i + 32].decode('utf-8').replace('\0', '').strip()
-            for i in range(0, len(script_nam_raw), 32)
+        with Mzp(allscr_path) as allscr_mzp:
+            # Zeroth entry is the script filenames. Each 32 byte chunk is one
+            # string, delete excess \0 chars and arrayize
+            script_nam_raw = bytes(allscr_mzp.data[0])
+            script_names = [
+                str(script_nam_raw[i:i + 32], 'utf-8').replace(
+                    '\0', '').strip()
+                for i in range(0, len(script_nam_raw), 32)
+            ]
+
+            # Entries 1/2 are unknown, 3+ are the game script files. Rather
+            # than sending the compressed data to the workers, just tell them
+            # where to find it so that they can read it from a mapping of the
+            # file.
+            compressed_script_ranges = [
+                allscr_mzp.entry_range(i)
+                for i in range(3, len(allscr_mzp.data))
+            ]
+            scene_commands = [None] * len(compressed_script_ranges)
+
+            # Pull whatever scenes we can out of the cache. Parse results
+            # also depend on the script text, so that goes into the key as
+            # well.
+            cache_keys = []
+            if cache:
+                context_digest = cache.context_digest(
+                    string_offsets_raw, string_table_raw)
+                for i in range(len(compressed_script_ranges)):
+                    cache_keys.append(cache.key(
+                        allscr_mzp.data[3 + i], context_digest))
+                    cached = cache.get(cache_keys[i])
+                    if cached is not None:
+                        scene_commands[i] = [
+                            cls.TextCommand.from_json(cmd) for cmd in cached
+                        ]
+
+        # Decompress and parse the remaining script files, getting back the
+        # list of text commands for each scene
+        uncached = [
+            i for i in range(len(compressed_script_ranges))
+            if scene_commands[i] is None
         ]
+        uncached_ranges = [compressed_script_ranges[i] for i in uncached]
+        extractor_args = (
+            allscr_path, strings_by_content_hash, content_hash_by_offset)
+        if not uncached:
+            extracted = []
+        elif jobs == 1:
+            extractor = cls.SceneExtractor(*extractor_args)
+            try:
+                extracted = [
+                    extractor.extract(entry_range)
+                    for entry_range in uncached_ranges
+                ]
+            finally:
+                extractor.close()
+        else:
+            with multiprocessing.Pool(
+                    min(jobs, len(uncached)),
+                    initializer=cls.SceneExtractor.init_worker,
+                    initargs=extractor_args) as pool:
+                extracted = pool.map(
+                    cls.SceneExtractor.extract_in_worker,
+                    uncached_ranges
+                )
 
-        # Entries 1/2 are unknown, 3+ are the game script files
-        compressed_script_files = allscr_mzp.data[3:]
+        for i, commands in zip(uncached, extracted):
+            scene_commands[i] = commands
+            if cache:
+                cache.put(cache_keys[i], [cmd.as_json() for cmd in commands])
 
-        # Decompress all the script files
-        with multiprocessing.Pool(multiprocessing.cpu_count()) as pool:
-            decompressed_script_files = pool.map(
-                Mzx.decompress,
-                compressed_script_files
-            )
+        if cache:
+            cache.evict()
 
         # For each scene, extract the list of text offsets
         scene_map = {}
         visited_offsets = set()
-        for scene_name, script \
-                in zip(script_names, decompressed_script_files):
-            scene_map[scene_name] = cls.parse_script_cmds(
-                script,
-                strings_by_content_hash,
-                content_hash_by_offset
-            )
-            for cmd in scene_map[scene_name]:
+        for scene_name, commands in zip(script_names, scene_commands):
+            scene_map[scene_name] = commands
+            for cmd in commands:
                 visited_offsets.add(cmd.offset)
 
         # Reparent any text lines that exist but aren't referenced by the
@@ -749,18 +1464,242 @@ class TranslationDb:
 
         return cls(scene_map, strings_by_content_hash, {})
 
+    class Progress:
+        def __init__(self, translated, total):
+            self.translated = translated
+            self.total = total
+
+        def percent(self):
+            return float(self.translated) * 100.0 / float(max(self.total, 1))
+
+        def __repr__(self):
+            return f"{self.translated}/{self.total} ({self.percent():.1f}%)"
+
+    class LineRenderCache:
+        """
+        Bounded LRU cache of rendered lines, keyed by everything that goes
+        into rendering a line (text, start cursor and flags).
+        """
+
+        DEFAULT_MAX_SIZE = 16384
+
+        def __init__(self, max_size=DEFAULT_MAX_SIZE):
+            self._max_size = max_size
+            self._entries = collections.OrderedDict()
+            self.hits = 0
+            self.misses = 0
+
+        def get(self, key):
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        def put(self, key, entry):
+            self._entries[key] = entry
+            if len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+        def clear(self):
+            self._entries.clear()
+
+        def hit_rate(self):
+            return self.hits / max(self.hits + self.misses, 1)
+
+        def __len__(self):
+            return len(self._entries)
+
+        def __repr__(self):
+            return (
+                f"{self.hits}/{self.hits + self.misses} hits "
+                f"({self.hit_rate() * 100:.1f}%), {len(self)} entries"
+            )
+
+    class SceneRenderError(RuntimeError):
+        def __init__(self, scene_name, message):
+            super().__init__(scene_name, message)
+            self.scene_name = scene_name
+            self.message = message
+
+        def __str__(self):
+            return f"{self.scene_name}: {self.message}"
+
+    class RenderProblem:
+        """
+        A line that failed to render, as collected by check_render.
+        """
+
+        def __init__(self, scene_name, offset, jp_hash, message):
+            self.scene_name = scene_name
+            self.offset = offset
+            self.jp_hash = jp_hash
+            self.message = message
+
+        def __eq__(self, other):
+            return isinstance(other, TranslationDb.RenderProblem) and \
+                vars(self) == vars(other)
+
+        def __repr__(self):
+            return (
+                f"RenderProblem<{self.scene_name}, {self.offset}, "
+                f"{self.jp_hash}, {self.message!r}>"
+            )
+
+        def __str__(self):
+            return (
+                f"{self.scene_name} @ {self.offset} ({self.jp_hash}): "
+                f"{self.message}"
+            )
+
+    class SceneRenderer:
+        """
+        Renders (linebreaks) scenes in generate_linebroken_text_map worker
+        processes. Each task holds a scene along with the lines and
+        overrides it uses, so workers need no copy of the full DB.
+        """
+
+        # Renderer owned by this worker process
+        _worker_instance = None
+
+        def __init__(self, charswap_map, perform_charswap, enable_pua_codes,
+                     collect_problems=False):
+            self._charswap_map = charswap_map
+            self._perform_charswap = perform_charswap
+            self._collect_problems = collect_problems
+
+            # Workers may not inherit the parent's settings
+            RubyUtils.ENABLE_PUA_CODES = enable_pua_codes
+
+            # Line render cache shared by every scene this worker renders
+            self._line_render_cache = TranslationDb.LineRenderCache()
+
+        def render(self, task):
+            # Returns the rendered scene, the problems found if collecting
+            # them, and the line render cache hits and misses it took
+            (scene_name, commands, line_by_hash, overrides_by_offset) = task
+            scene_db = TranslationDb(
+                {scene_name: commands}, line_by_hash, overrides_by_offset,
+                self._charswap_map)
+            scene_db._line_render_cache = self._line_render_cache
+
+            (hits, misses) = (
+                self._line_render_cache.hits, self._line_render_cache.misses)
+            problems = [] if self._collect_problems else None
+            rendered = scene_db._render_scene(
+                scene_name, commands, self._perform_charswap, problems)
+            return (
+                rendered,
+                problems,
+                self._line_render_cache.hits - hits,
+                self._line_render_cache.misses - misses
+            )
+
+        @classmethod
+        def init_worker(cls, *args):
+            cls._worker_instance = cls(*args)
+
+        @classmethod
+        def render_in_worker(cls, task):
+            return cls._worker_instance.render(task)
+
+    class SceneExtractor:
+        """
+        Decompresses and parses allscr scenes, reading the compressed data
+        straight from a read-only mapping of the allscr file.
+        Used by the from_mrg worker processes so that only the (small) list
+        of text commands for each scene has to be sent back.
+        """
+
+        # Extractor owned by this worker process
+        _worker_instance = None
+
+        def __init__(self, allscr_path, strings_by_content_hash,
+                     content_hash_by_offset):
+            self._strings_by_content_hash = strings_by_content_hash
+            self._content_hash_by_offset = content_hash_by_offset
+            self._file = open(allscr_path, 'rb')
+            self._mapping = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        def extract(self, entry_range):
+            # The script is tokenized as it is inflated, so the whole
+            # decompressed script never has to be held at once
+            (start, size) = entry_range
+            with memoryview(self._mapping) as view, \
+                    view[start:start + size] as compressed:
+                return TranslationDb.parse_script_cmds(
+                    Mzx.decompress_iter(compressed),
+                    self._strings_by_content_hash,
+                    self._content_hash_by_offset
+                )
+
+        def close(self):
+            self._mapping.close()
+            self._file.close()
+
+        @classmethod
+        def init_worker(cls, *args):
+            cls._worker_instance = cls(*args)
+
+        @classmethod
+        def extract_in_worker(cls, entry_range):
+            return cls._worker_instance.extract(entry_range)
+
     class TextCommand:
+        # Packed flag bits
+        FLAG_HAS_RUBY = 1 << 0
+        FLAG_IS_GLUED = 1 << 1
+        FLAG_IS_CHOICE = 1 << 2
+        FLAG_HAS_FORCED_NEWLINE = 1 << 3
+
+        # Modifier lists are small and heavily repeated, so every distinct
+        # one is stored once as a shared tuple
+        _modifier_tuples = {(): ()}
+
+        __slots__ = ('offset', 'jp_hash', 'page_number', '_flags', 'modifiers')
+
         def __init__(self, offset, jp_hash, page_number, has_ruby=False,
                      is_glued=False, is_choice=False, modifiers=None,
                      has_forced_newline=False):
             self.offset = offset
-            self.jp_hash = jp_hash
+            # Many commands share a hash, and the hash is also the key of the
+            # line table, so share a single copy of each
+            self.jp_hash = sys.intern(jp_hash)
             self.page_number = page_number
-            self.has_ruby = has_ruby
-            self.is_glued = is_glued
-            self.is_choice = is_choice
-            self.modifiers = modifiers or []
-            self.has_forced_newline = has_forced_newline
+            self._flags = (
+                (self.FLAG_HAS_RUBY if has_ruby else 0) |
+                (self.FLAG_IS_GLUED if is_glued else 0) |
+                (self.FLAG_IS_CHOICE if is_choice else 0) |
+                (self.FLAG_HAS_FORCED_NEWLINE if has_forced_newline else 0)
+            )
+            modifiers = tuple(modifiers or ())
+            self.modifiers = self._modifier_tuples.setdefault(
+                modifiers, modifiers)
+
+        def _flag(self, flag):
+            return bool(self._flags & flag)
+
+        def _set_flag(self, flag, value):
+            self._flags = (self._flags | flag) if value \
+                else (self._flags & ~flag)
+
+        has_ruby = property(
+            lambda self: self._flag(self.FLAG_HAS_RUBY),
+            lambda self, value: self._set_flag(self.FLAG_HAS_RUBY, value))
+        is_glued = property(
+            lambda self: self._flag(self.FLAG_IS_GLUED),
+            lambda self, value: self._set_flag(self.FLAG_IS_GLUED, value))
+        is_choice = property(
+            lambda self: self._flag(self.FLAG_IS_CHOICE),
+            lambda self, value: self._set_flag(self.FLAG_IS_CHOICE, value))
+        has_forced_newline = property(
+            lambda self: self._flag(self.FLAG_HAS_FORCED_NEWLINE),
+            lambda self, value: self._set_flag(
+                self.FLAG_HAS_FORCED_NEWLINE, value))
 
         def __eq__(self, other):
             # Default impl doesn't work for whatever reason
@@ -773,6 +1712,15 @@ class TranslationDb:
                     return False
             return True
 
+        def __reduce__(self):
+            # Commands come back from worker processes pickled. Unpickle
+            # through the constructor so that they share storage too.
+            return (type(self), (
+                self.offset, self.jp_hash, self.page_number, self.has_ruby,
+                self.is_glued, self.is_choice, self.modifiers,
+                self.has_forced_newline
+            ))
+
         @classmethod
         def from_json(cls, jsonb):
             return cls(
@@ -783,7 +1731,7 @@ class TranslationDb:
                 jsonb.get('is_glued', False),
                 jsonb.get('is_choice', False),
                 jsonb.get('modifiers'),
-                jsonb.get('has_forced_newline')
+                jsonb.get('has_forced_newline', False)
             )
 
         def as_json(self):
@@ -804,7 +1752,7 @@ class TranslationDb:
                 ret['is_choice'] = True
 
             if self.modifiers:
-                ret['modifiers'] = self.modifiers
+                ret['modifiers'] = list(self.modifiers)
 
             if self.has_forced_newline:
                 ret['has_forced_newline'] = self.has_forced_newline
@@ -854,6 +1802,8 @@ class TranslationDb:
             }
 
     class TLLine:
+        __slots__ = ('jp_text', 'en_text', 'comment')
+
         def __init__(self, jp_text, en_text=None, comment=None):
             self.jp_text = jp_text
             self.en_text = en_text
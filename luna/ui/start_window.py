@@ -170,8 +170,7 @@ class StartWindow:
             )
 
             # Cache it to file
-            with open(Constants.DATABASE_PATH, 'wb+') as output:
-                output.write(tl_db.as_json().encode('utf-8'))
+            tl_db.to_file(Constants.DATABASE_PATH)
 
             # Open the main window
             self.btn_open_main_window()
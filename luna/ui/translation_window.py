@@ -39,7 +39,7 @@ class TranslationWindow:
 
         # Try and load the translation DB from file
         self._translation_db = TranslationDb.from_file(
-            Constants.DATABASE_PATH)
+            Constants.DATABASE_PATH, write_through=True)
 
         # Configure UI
         self._root.resizable(height=False, width=False)
@@ -86,24 +86,18 @@ class TranslationWindow:
             return
 
         # How many lines are actually TLd
-        scene_lines = self._translation_db.lines_for_scene(self._loaded_scene)
-        idx = 0
-        translated_count = 0
-        for line in scene_lines:
-            tl_info = self._translation_db.tl_line_with_hash(line.jp_hash)
-            if tl_info.en_text:
-                translated_count += 1
-            idx += 1
+        progress = self._translation_db.translation_progress(
+            self._loaded_scene)
 
         # Update UI
         self.percent_translated_day.delete("1.0", tk.END)
         self.percent_translated_day.insert(
-            "1.0",
-            str(round(translated_count*100/max(idx, 1), 1))+"%")
+            "1.0", "%.1f%%" % progress.percent())
         self._name_day.set(self._loaded_scene + ": ")
 
     def on_close(self):
-        # Prompt to save the DB
+        # Edits are persisted as they are made (see from_file), so there is
+        # nothing to discard. Offer to fold them back into the DB file.
         self._warning = tk.Toplevel(self._root)
         self._warning.title("deepLuna")
         self._warning.resizable(height=False, width=False)
@@ -113,7 +107,8 @@ class TranslationWindow:
         # Warning text
         warning_message = tk.Label(
             self._warning,
-            text="WARNING: Do you want to close without saving?"
+            text="All edits have been kept. Write them into the database "
+                 "file before quitting?"
         )
         warning_message.grid(row=0, column=0, pady=5)
 
@@ -136,9 +131,8 @@ class TranslationWindow:
         self.frame_quit_buttons.grid(row=1, column=0, pady=5)
 
     def save_and_quit(self):
-        # Save DB
-        with open(Constants.DATABASE_PATH, 'wb+') as output:
-            output.write(self._translation_db.as_json().encode('utf-8'))
+        # Save DB, folding any journalled edits back into it
+        self._translation_db.to_file(Constants.DATABASE_PATH)
 
         # Exit
         self.quit_editor()
@@ -395,19 +389,15 @@ class TranslationWindow:
 
     def save_translation_table(self):
         # Write out the translation DB to file
-        with open(Constants.DATABASE_PATH, 'wb+') as output:
-            output.write(self._translation_db.as_json().encode('utf-8'))
+        self._translation_db.save(Constants.DATABASE_PATH)
 
     def insert_translation(self):
-        # Export the script as an MZP
-        mzp_data = self._translation_db.generate_script_text_mrg(
-            perform_charswap=self.var_swapText.get())
-
-        # Write to file
+        # Export the script as an MZP, straight to file
         current_time = time.strftime('%Y%m%d-%H%M%S')
         output_filename = f"script_text_translated{current_time}.mrg"
-        with open(output_filename, 'wb+') as f:
-            f.write(mzp_data)
+        self._translation_db.write_script_text_mrg(
+            output_filename, perform_charswap=self.var_swapText.get(),
+            jobs=None)
 
         print(f"Exported translation to {output_filename}")
 
@@ -534,7 +524,6 @@ class TranslationWindow:
 
         print(f"Conflict count: {len(self._active_conflicts)} ")
 
-        # Prompt to save the DB
         self._conflict_dialog = tk.Toplevel(self._root)
         self._conflict_dialog.title("Resolve Conflicts")
         self._conflict_dialog.resizable(height=True, width=True)
@@ -555,9 +544,10 @@ class TranslationWindow:
         for jp_hash in ordered_hashes:
             jp_text = self._translation_db.tl_line_with_hash(jp_hash).jp_text
             entry_group = self._active_conflicts[jp_hash]
+            usage_count = self._translation_db.usage_count(jp_hash)
             tk.Label(
                 frame_listboxes,
-                text=f"{jp_hash}\n{jp_text.rstrip()}"
+                text=f"{jp_hash} (used {usage_count}x)\n{jp_text.rstrip()}"
             ).grid(row=len(self._conflict_listboxes)*2, column=0)
 
             # Create a listbox to select the correct tl
@@ -909,6 +899,14 @@ class TranslationWindow:
         # Get the translation data for this JP hash
         tl_info = self._translation_db.tl_line_with_hash(selected_line.jp_hash)
 
+        # Show how many places an edit to this line will affect
+        usage_count = self._translation_db.usage_count(selected_line.jp_hash)
+        scene_count = len(
+            self._translation_db.scenes_for_hash(selected_line.jp_hash))
+        self.labels_txt_orig.config(
+            text=f"Original text (used {usage_count}x in "
+                 f"{scene_count} scene(s)):")
+
         # Update the text fields
         with self.editable_orig_text():
             self.text_orig.delete("1.0", tk.END)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from luna.constants import Constants
+from luna.db_format import DbFormats
+from luna.mrg_parser import Mzp
+from luna.mzx import Mzx
+from luna.translation_db import TranslationDb
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="deepLuna benchmarks and reports"
+    )
+
+    parser.add_argument(
+        '--allscr',
+        dest='allscr_path',
+        action='store',
+        help="Path to allscr.mrg",
+        default=Constants.ALLSCR_MRG
+    )
+
+    parser.add_argument(
+        '--db-path',
+        dest='db_path',
+        action='store',
+        help="Path to translation DB file",
+        default=Constants.DATABASE_PATH
+    )
+
+    parser.add_argument(
+        '--mzx',
+        dest='do_mzx',
+        action='store_true',
+        help="Recompress every allscr scene and report ratio/throughput"
+    )
+
+    parser.add_argument(
+        '--db-formats',
+        dest='do_db_formats',
+        action='store_true',
+        help="Report size and load/save time of the DB in each format"
+    )
+
+    parser.add_argument(
+        '--memory',
+        dest='do_memory',
+        action='store_true',
+        help="Report the memory used by the loaded DB"
+    )
+
+    parser.add_argument(
+        '--render',
+        dest='do_render',
+        action='store_true',
+        help="Time a full render of the DB for injection"
+    )
+
+    parser.add_argument(
+        '--parse',
+        dest='do_parse',
+        action='store_true',
+        help="Compare allscr command scanning against full tokenizing"
+    )
+
+    parser.add_argument(
+        '--jobs',
+        dest='jobs',
+        action='store',
+        type=int,
+        default=1,
+        help="Number of worker processes to render with"
+    )
+
+    return parser.parse_args(sys.argv[1:])
+
+
+def format_rate(byte_count, seconds):
+    return f"{byte_count / max(seconds, 1e-9) / (1024 * 1024):.2f} MiB/s"
+
+
+def bench_mzx(args):
+    # Entries 3+ are the compressed scene scripts
+    with Mzp(args.allscr_path) as allscr_mzp:
+        scenes = [bytes(compressed) for compressed in allscr_mzp.data[3:]]
+
+    original_size = 0
+    decompressed_size = 0
+    recompressed_size = 0
+    decompress_time = 0.0
+    compress_time = 0.0
+    for compressed in scenes:
+        start = time.perf_counter()
+        script = Mzx.decompress(compressed)
+        decompress_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        recompressed = Mzx.compress(script)
+        compress_time += time.perf_counter() - start
+
+        # Make sure that the data actually survives the round trip
+        assert Mzx.decompress(recompressed) == script, \
+            "MZX round trip mismatch"
+
+        original_size += len(compressed)
+        decompressed_size += len(script)
+        recompressed_size += len(recompressed)
+
+    print(f"Scenes:              {len(scenes)}")
+    print(f"Decompressed size:   {decompressed_size} bytes")
+    print(
+        f"Original MZX size:   {original_size} bytes "
+        f"({original_size * 100 / max(decompressed_size, 1):.1f}%)")
+    print(
+        f"Recompressed size:   {recompressed_size} bytes "
+        f"({recompressed_size * 100 / max(decompressed_size, 1):.1f}%)")
+    print(
+        f"Decompression:       {decompress_time:.2f}s, "
+        f"{format_rate(decompressed_size, decompress_time)}")
+    print(
+        f"Compression:         {compress_time:.2f}s, "
+        f"{format_rate(decompressed_size, compress_time)}")
+
+
+def bench_db_formats(args):
+    tl_db = TranslationDb.from_file(args.db_path)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for db_format in DbFormats.ALL:
+            path = os.path.join(tmpdir, db_format.NAME)
+
+            start = time.perf_counter()
+            tl_db.to_file(path, db_format=db_format.NAME)
+            save_time = time.perf_counter() - start
+
+            # Load, then time saving again after a single edit
+            start = time.perf_counter()
+            loaded_db = TranslationDb.from_file(path, write_through=True)
+            load_time = time.perf_counter() - start
+
+            jp_hash = next(iter(loaded_db.contents()[1]))
+            line = loaded_db.tl_line_with_hash(jp_hash)
+            start = time.perf_counter()
+            loaded_db.set_translation_and_comment_for_hash(
+                jp_hash, line.en_text, line.comment)
+            loaded_db.save(path)
+            edit_time = time.perf_counter() - start
+            loaded_db.close()
+
+            print(
+                f"{db_format.NAME:8} {os.path.getsize(path):>12} bytes, "
+                f"save {save_time:.3f}s, load {load_time:.3f}s, "
+                f"single edit save {edit_time:.4f}s")
+    tl_db.close()
+
+
+def bench_memory(args):
+    # Only count what the DB itself holds on to once loaded
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    tl_db = TranslationDb.from_file(args.db_path)
+
+    # Make sure everything is actually loaded, for lazy storage formats
+    (scene_map, line_by_hash, overrides_by_offset, _) = tl_db.contents()
+    command_count = sum(len(commands) for commands in scene_map.values())
+    line_count = len(line_by_hash) + len(overrides_by_offset)
+    load_time = time.perf_counter() - start
+
+    gc.collect()
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"Commands:            {command_count}")
+    print(f"Lines:               {line_count}")
+    print(f"Load time:           {load_time:.2f}s")
+    print(f"Resident DB size:    {current / (1024 * 1024):.1f} MiB")
+    print(f"Peak while loading:  {peak / (1024 * 1024):.1f} MiB")
+    tl_db.close()
+
+
+def bench_render(args):
+    tl_db = TranslationDb.from_file(args.db_path)
+
+    start = time.perf_counter()
+    tl_db.generate_linebroken_text_map(force_full=True, jobs=args.jobs)
+    render_time = time.perf_counter() - start
+
+    print(f"Scenes:              {len(tl_db.scene_names(include_empty=True))}")
+    print(f"Full render:         {render_time:.2f}s")
+    print(f"Line render cache:   {tl_db.line_render_cache()}")
+    tl_db.close()
+
+
+def tokenize_text_cmds(script):
+    # Reference for scan_script_cmds: decode, split and parse every command,
+    # then keep the ones that text extraction uses
+    text_cmds = []
+    for cmd in TranslationDb.split_script_cmds(script):
+        match = TranslationDb.SCRIPT_CMD_REGEX.match(cmd)
+        if not match:
+            continue
+        (opcode, arguments) = match.groups()
+        if opcode in ('PGST', 'MSAD', 'SELR') or opcode.startswith('ZM'):
+            text_cmds.append((opcode, arguments.split(',')))
+    return text_cmds
+
+
+def bench_parse(args):
+    with Mzp(args.allscr_path) as allscr_mzp:
+        scripts = [
+            Mzx.decompress(compressed) for compressed in allscr_mzp.data[3:]
+        ]
+
+    command_count = sum(script.count(b';') for script in scripts)
+    text_command_count = 0
+    tokenize_time = 0.0
+    scan_time = 0.0
+    for script in scripts:
+        start = time.perf_counter()
+        expect = tokenize_text_cmds(script)
+        tokenize_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        scanned = list(TranslationDb.scan_script_cmds(script))
+        scan_time += time.perf_counter() - start
+
+        # The scanner has to find exactly the same commands
+        scanned = [
+            (opcode, [
+                arg.decode('ascii') if isinstance(arg, bytes) else arg
+                for arg in arguments
+            ])
+            for opcode, arguments in scanned
+        ]
+        assert scanned == expect, "Scanned commands mismatch"
+        text_command_count += len(scanned)
+
+    print(f"Scenes:              {len(scripts)}")
+    print(f"Commands:            {command_count}")
+    print(f"Text commands:       {text_command_count}")
+    print(
+        f"Tokenize:            {tokenize_time:.2f}s, "
+        f"{command_count / max(tokenize_time, 1e-9):.0f} commands/s")
+    print(
+        f"Scan:                {scan_time:.2f}s, "
+        f"{command_count / max(scan_time, 1e-9):.0f} commands/s")
+
+
+def main():
+    args = parse_args()
+
+    if args.do_mzx:
+        bench_mzx(args)
+
+    if args.do_db_formats:
+        bench_db_formats(args)
+
+    if args.do_memory:
+        bench_memory(args)
+
+    if args.do_render:
+        bench_render(args)
+
+    if args.do_parse:
+        bench_parse(args)
+
+
+if __name__ == '__main__':
+    main()
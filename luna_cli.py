@@ -6,8 +6,11 @@ import sys
 import time
 
 from luna.constants import Constants
+from luna.db_format import DbFormats
+from luna.mrg_parser import Mzp
 from luna.translation_db import TranslationDb
 from luna.ruby_utils import RubyUtils
+from luna.scene_cache import SceneCache
 
 
 class Color:
@@ -46,6 +49,22 @@ def parse_args():
         help="Regenerate DB from MRG files"
     )
 
+    parser.add_argument(
+        '--no-cache',
+        dest='no_cache',
+        action='store_true',
+        help="Do not use the scene cache when extracting the DB"
+    )
+
+    parser.add_argument(
+        '--jobs',
+        dest='jobs',
+        action='store',
+        type=int,
+        help="Number of worker processes to use for extraction and "
+             "injection (default: one per CPU)"
+    )
+
     parser.add_argument(
         '--import',
         dest='import_path',
@@ -95,6 +114,35 @@ def parse_args():
         action='store',
         help="Output path for the injected script text"
     )
+    parser.add_argument(
+        '--inject-base',
+        dest='inject_base',
+        action='store',
+        help="Inject into a copy of this script_text.mrg, only rewriting "
+             "the sections that change"
+    )
+    parser.add_argument(
+        '--inject-pooled',
+        dest='inject_pooled',
+        action='store_true',
+        help="Store identical sections of the injected script text only "
+             "once, and verify the result"
+    )
+    parser.add_argument(
+        '--inject-incremental',
+        dest='inject_incremental',
+        action='store_true',
+        help="Update the script text at --inject-output in place, only "
+             "rendering scenes that changed since it was last injected this "
+             "way"
+    )
+    parser.add_argument(
+        '--check-render',
+        dest='do_check_render',
+        action='store_true',
+        help="Render every scene without injecting, and report every line "
+             "that fails to render"
+    )
     parser.add_argument(
         '--enable-pua',
         dest='enable_pua',
@@ -109,6 +157,15 @@ def parse_args():
         help="Output path for the exported script text"
     )
 
+    parser.add_argument(
+        '--db-format',
+        dest='db_format',
+        action='store',
+        choices=DbFormats.names(),
+        help="Format to save the translation DB in (default: keep the "
+             "format it was loaded from)"
+    )
+
     parser.add_argument(
         '--no-save',
         dest='no_save',
@@ -119,6 +176,15 @@ def parse_args():
     return parser.parse_args(sys.argv[1:])
 
 
+def describe_usages(tl_db, jp_hash):
+    # Summarise where a content-addressed line ends up
+    scenes = tl_db.scenes_for_hash(jp_hash)
+    return (
+        f"Used {tl_db.usage_count(jp_hash)} time(s) in: "
+        f"{', '.join(scenes) or 'no scenes'}\n"
+    )
+
+
 def import_mergetool(tl_db, import_diff):
     for sha, entry_group in import_diff.entries_by_sha.items():
         # Ignore the non-conflicting entries
@@ -160,6 +226,7 @@ def import_mergetool(tl_db, import_diff):
         print(
             Color(Color.RED)(f"Import conflict for line {sha}:\n") +
             Color(Color.YELLOW)(f"JP: {line.jp_text.rstrip()}\n") +
+            Color(Color.YELLOW)(describe_usages(tl_db, sha)) +
             Color(Color.CYAN)(f"{msg}")
         )
         while True:
@@ -240,6 +307,7 @@ def perform_import(tl_db, args):
                 print(
                     Color(Color.RED)(f"Import conflict for line {sha}:\n") +
                     Color(Color.YELLOW)(f"JP: {line.jp_text.rstrip()}\n") +
+                    Color(Color.YELLOW)(describe_usages(tl_db, sha)) +
                     Color(Color.CYAN)(f"{msg}")
                 )
 
@@ -290,14 +358,55 @@ def perform_inject(tl_db, args):
     output_filename = \
         args.inject_output or f"script_text_translated{current_time}.mrg"
 
-    # Export the script as an MZP
-    mzp_data = tl_db.generate_script_text_mrg()
-
-    # Write to file
-    with open(output_filename, 'wb+') as f:
-        f.write(mzp_data)
+    if args.inject_incremental:
+        if not args.inject_output:
+            raise SystemExit("--inject-incremental needs --inject-output")
+
+        # Start from the base archive the first time around
+        if args.inject_base and not os.path.exists(output_filename):
+            shutil.copyfile(args.inject_base, output_filename)
+
+        rendered = tl_db.inject_incremental(output_filename, jobs=args.jobs)
+        if not rendered:
+            print(f"'{output_filename}' is up to date")
+            return
+        print(f"Rendered {len(rendered)} changed scenes")
+    elif args.inject_base:
+        # Patch a copy of the base archive
+        shutil.copyfile(args.inject_base, output_filename)
+        changed = tl_db.patch_script_text_mrg(
+            output_filename, jobs=args.jobs)
+        print(f"Patched sections {changed} of '{args.inject_base}'")
+    elif args.inject_pooled:
+        offset_to_string = tl_db.generate_linebroken_text_map(jobs=args.jobs)
+        sections = tl_db.linebroken_text_sections(offset_to_string)
+        written = Mzp.write(output_filename, sections, pool=True)
+        print(
+            f"Pooling saved {Mzp.packed_size(sections) - written} bytes "
+            f"({written} bytes written)")
+
+        # Make sure the archive still decodes to the same script
+        problems = tl_db.verify_script_text_mrg(
+            output_filename, offset_to_string)
+        for problem in problems:
+            print(problem)
+        if problems:
+            raise SystemExit(f"'{output_filename}' failed verification")
+    else:
+        # Export the script as an MZP, straight to file
+        tl_db.write_script_text_mrg(output_filename, jobs=args.jobs)
 
     print(f"Wrote script to '{output_filename}'")
+    print(f"Line render cache: {tl_db.line_render_cache()}")
+
+
+def perform_check_render(tl_db, args):
+    problems = tl_db.check_render(jobs=args.jobs)
+    for problem in problems:
+        print(problem)
+
+    scene_count = len({problem.scene_name for problem in problems})
+    print(f"{len(problems)} lines failed to render in {scene_count} scenes")
 
 
 def perform_export(tl_db, args):
@@ -311,9 +420,16 @@ def main():
     # Do we need to extract the DB?
     tl_db = None
     if args.do_extract:
-        tl_db = TranslationDb.from_mrg("allscr.mrg", "script_text.mrg")
+        cache = (
+            None if args.no_cache
+            else SceneCache(Constants.SCENE_CACHE_DIRECTORY)
+        )
+        tl_db = TranslationDb.from_mrg(
+            "allscr.mrg", "script_text.mrg", jobs=args.jobs, cache=cache)
     else:
-        tl_db = TranslationDb.from_file(args.db_path)
+        # Persist edits as they are made, unless we aren't saving at all
+        tl_db = TranslationDb.from_file(
+            args.db_path, write_through=not args.no_save)
 
     # Cl offset override table?
     if args.reset_overrides:
@@ -329,6 +445,10 @@ def main():
     if args.enable_pua:
         RubyUtils.ENABLE_PUA_CODES = True
 
+    # Check that everything renders?
+    if args.do_check_render:
+        perform_check_render(tl_db, args)
+
     # Inject anything?
     if args.do_inject:
         perform_inject(tl_db, args)
@@ -337,7 +457,8 @@ def main():
         perform_export(tl_db, args)
 
     if not args.no_save:
-        tl_db.to_file(args.db_path)
+        tl_db.to_file(args.db_path, db_format=args.db_format)
+    tl_db.close()
 
 
 if __name__ == '__main__':
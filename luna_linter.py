@@ -1296,7 +1296,11 @@ def main():
                 deduped[key].append(entry)
 
             line = tl_db.tl_line_with_hash(sha)
-            msg = "Imported candidates:\n"
+            msg = (
+                f"Used {tl_db.usage_count(sha)} time(s) in: "
+                f"{', '.join(tl_db.scenes_for_hash(sha))}\n"
+                "Imported candidates:\n"
+            )
             for tl, comment in deduped:
                 entry_list = deduped[(tl, comment)]
                 entry = entry_list[0]
@@ -1348,6 +1352,8 @@ def main():
     for scene in tl_db.scene_names():
         lint_results += process_scene(tl_db, linters, scene)
 
+    tl_db.close()
+
     report_results(lint_results)
     sys.exit(1 if lint_results else 0)
 
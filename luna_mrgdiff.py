@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+
+from luna.mrg_diff import MrgDiff
+
+
+class Color:
+    RED = '\033[31m'
+    GREEN = '\033[32m'
+    YELLOW = '\033[33m'
+    ENDC = '\033[0m'
+
+    def __init__(self, color):
+        self.color = color
+
+    def __call__(self, text):
+        return f"{self.color}{text}{Color.ENDC}"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare two MRG archives section by section. "
+                    "Exits non-zero if they differ."
+    )
+
+    parser.add_argument('path_a', help="First MRG archive")
+    parser.add_argument('path_b', help="Second MRG archive")
+
+    parser.add_argument(
+        '--max-offsets',
+        dest='max_offsets',
+        action='store',
+        type=int,
+        default=50,
+        help="Maximum number of changed string offsets to list per table"
+    )
+
+    return parser.parse_args(sys.argv[1:])
+
+
+def main():
+    args = parse_args()
+
+    diff = MrgDiff(args.path_a, args.path_b)
+    if diff.is_identical():
+        print(Color(Color.GREEN)("Archives are identical"))
+        return
+
+    for section_diff in diff.changed_sections:
+        print(Color(Color.RED)(str(section_diff)))
+
+    for (offset_idx, string_idx), offsets in diff.changed_strings.items():
+        listed = ', '.join(str(o) for o in offsets[:args.max_offsets])
+        extras = (
+            f" (and {len(offsets) - args.max_offsets} more)"
+            if len(offsets) > args.max_offsets else ""
+        )
+        print(Color(Color.YELLOW)(
+            f"Tables {offset_idx}/{string_idx}: {len(offsets)} string "
+            f"offsets differ: {listed}{extras}"
+        ))
+
+    raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import os
+import tempfile
+import unittest
+
+from luna.db_format import BinaryDbFormat, DbFormats, JsonDbFormat, \
+    SqliteDbFormat
+from luna.translation_db import TranslationDb
+
+
+class DbFormatTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmpdir.name, 'db')
+
+        lines = [
+            TranslationDb.TLLine("一行目\r\n", "Line one", "A comment"),
+            TranslationDb.TLLine("<二|に>行目"),
+            TranslationDb.TLLine("三行目", "", None),
+        ]
+        scene_map = {
+            'SCENE_B': [
+                TranslationDb.TextCommand(
+                    0, lines[0].content_hash(), 1,
+                    modifiers=["@n"], has_forced_newline=True),
+                TranslationDb.TextCommand(
+                    1, lines[1].content_hash(), 1, has_ruby=True,
+                    is_glued=True, modifiers=["@k", "@e"]),
+            ],
+            'SCENE_A': [
+                TranslationDb.TextCommand(
+                    2, lines[2].content_hash(), 7, is_choice=True),
+            ],
+            'EMPTY': [],
+            'ORPHANED_LINES': [
+                TranslationDb.TextCommand(3, lines[0].content_hash(), -1),
+            ],
+        }
+        self.db = TranslationDb(
+            scene_map,
+            {line.content_hash(): line for line in lines},
+            {3: TranslationDb.TLLine("一行目\r\n", "Override", None)},
+            {'é': '@', 'ü': '#'}
+        )
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_binary_round_trip(self):
+        raw = BinaryDbFormat.dumps(self.db)
+        loaded = BinaryDbFormat.loads(TranslationDb, raw)
+        self.assertEqual(loaded.as_json(), self.db.as_json())
+        self.assertEqual(
+            loaded.scene_names(include_empty=True),
+            self.db.scene_names(include_empty=True))
+        for scene in self.db.scene_names():
+            self.assertEqual(
+                loaded.lines_for_scene(scene),
+                self.db.lines_for_scene(scene))
+
+    def test_json_to_binary_to_json(self):
+        self.db.to_file(self.path, db_format=JsonDbFormat.NAME)
+        json_db = TranslationDb.from_file(self.path)
+        json_db.to_file(self.path, db_format=BinaryDbFormat.NAME)
+        binary_db = TranslationDb.from_file(self.path)
+        self.assertEqual(binary_db.as_json(), self.db.as_json())
+
+    def test_detect_and_keep_format(self):
+        self.db.to_file(self.path, db_format=BinaryDbFormat.NAME)
+        with open(self.path, 'rb') as f:
+            self.assertIs(DbFormats.detect(f.read()), BinaryDbFormat)
+
+        # Saving again without a format keeps the binary format
+        TranslationDb.from_file(self.path).to_file(self.path)
+        with open(self.path, 'rb') as f:
+            self.assertIs(DbFormats.detect(f.read()), BinaryDbFormat)
+
+        # Freshly constructed DBs default to JSON
+        self.db.to_file(self.path)
+        with open(self.path, 'rb') as f:
+            self.assertIs(DbFormats.detect(f.read()), JsonDbFormat)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            DbFormats.by_name('xml')
+
+    def test_sqlite_round_trip(self):
+        self.db.to_file(self.path, db_format=SqliteDbFormat.NAME)
+        self.assertIs(DbFormats.detect_file(self.path), SqliteDbFormat)
+
+        sqlite_db = TranslationDb.from_file(self.path)
+        try:
+            self.assertEqual(sqlite_db.as_json(), self.db.as_json())
+            self.assertEqual(
+                sqlite_db.scene_names(include_empty=True),
+                self.db.scene_names(include_empty=True))
+        finally:
+            sqlite_db.close()
+
+    def test_sqlite_read_only_close(self):
+        self.db.to_file(self.path, db_format=SqliteDbFormat.NAME)
+
+        # Without write through the DB still reads from the database, until
+        # it is closed
+        sqlite_db = TranslationDb.from_file(self.path)
+        self.assertIsNone(sqlite_db.store())
+        self.assertTrue(os.path.exists(self.path + '-wal'))
+        self.assertEqual(sqlite_db.as_json(), self.db.as_json())
+        sqlite_db.close()
+
+        # Closing the last connection folds the WAL back in and removes it
+        self.assertFalse(os.path.exists(self.path + '-wal'))
+        self.assertFalse(os.path.exists(self.path + '-shm'))
+
+    def test_sqlite_save_keeps_open_writers(self):
+        self.db.to_file(self.path, db_format=SqliteDbFormat.NAME)
+        jp_hash = self.db.lines_for_scene('SCENE_B')[1].jp_hash
+
+        # Another tool has the DB open while this one saves over it
+        open_db = TranslationDb.from_file(self.path, write_through=True)
+        try:
+            self.db.to_file(self.path, db_format=SqliteDbFormat.NAME)
+            open_db.set_translation_and_comment_for_hash(
+                jp_hash, "Edited elsewhere", None)
+        finally:
+            open_db.close()
+
+        reopened_db = TranslationDb.from_file(self.path)
+        try:
+            self.assertEqual(
+                reopened_db.tl_line_with_hash(jp_hash).en_text,
+                "Edited elsewhere")
+            self.assertEqual(
+                reopened_db.scene_names(include_empty=True),
+                self.db.scene_names(include_empty=True))
+        finally:
+            reopened_db.close()
+
+    def test_sqlite_writes_edits_through(self):
+        self.db.to_file(self.path, db_format=SqliteDbFormat.NAME)
+        jp_hash = self.db.lines_for_scene('SCENE_B')[1].jp_hash
+
+        # Edit without an explicit save
+        sqlite_db = TranslationDb.from_file(self.path, write_through=True)
+        sqlite_db.set_translation_and_comment_for_hash(
+            jp_hash, "Line two", "Note")
+        sqlite_db.override_translation_and_comment_for_offset(
+            2, "Override two", None)
+        sqlite_db.set_charswap_map({'ñ': '~'})
+        sqlite_db.close()
+
+        reopened_db = TranslationDb.from_file(self.path, write_through=True)
+        try:
+            line = reopened_db.tl_line_with_hash(jp_hash)
+            self.assertEqual(
+                (line.en_text, line.comment), ("Line two", "Note"))
+            self.assertEqual(
+                reopened_db.tl_override_for_offset(2).en_text, "Override two")
+            self.assertEqual(
+                reopened_db.tl_override_for_offset(3).en_text, "Override")
+            self.assertEqual(reopened_db.get_charswap_map(), {'ñ': '~'})
+
+            # Clearing overrides is persisted too
+            reopened_db.clear_offset_overrides()
+        finally:
+            reopened_db.close()
+
+        cleared_db = TranslationDb.from_file(self.path)
+        try:
+            self.assertIsNone(cleared_db.tl_override_for_offset(3))
+        finally:
+            cleared_db.close()
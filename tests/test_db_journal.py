@@ -0,0 +1,139 @@
+import os
+import tempfile
+import unittest
+
+from luna.db_journal import DbJournal
+from luna.translation_db import TranslationDb
+
+
+class DbJournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmpdir.name, 'db.json')
+        self.journal_path = DbJournal.path_for(self.path)
+
+        lines = [
+            TranslationDb.TLLine("一行目"),
+            TranslationDb.TLLine("二行目"),
+        ]
+        self.hashes = [line.content_hash() for line in lines]
+        TranslationDb(
+            {
+                'SCENE': [
+                    TranslationDb.TextCommand(0, self.hashes[0], 0),
+                    TranslationDb.TextCommand(1, self.hashes[1], 0),
+                ],
+            },
+            {line.content_hash(): line for line in lines},
+            {}
+        ).to_file(self.path)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def read_snapshot(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_edits_are_replayed(self):
+        snapshot = self.read_snapshot()
+
+        db = TranslationDb.from_file(self.path, write_through=True)
+        db.set_translation_and_comment_for_hash(
+            self.hashes[0], "Line one", "Note")
+        db.override_translation_and_comment_for_offset(1, "Override", None)
+        db.set_charswap_map({'é': '@'})
+        db.save(self.path)
+        db.close()
+
+        # The snapshot is untouched, the edits only went to the journal
+        self.assertEqual(self.read_snapshot(), snapshot)
+        self.assertGreater(os.path.getsize(self.journal_path), 0)
+
+        db = TranslationDb.from_file(self.path)
+        line = db.tl_line_with_hash(self.hashes[0])
+        self.assertEqual((line.en_text, line.comment), ("Line one", "Note"))
+        self.assertEqual(db.tl_override_for_offset(1).en_text, "Override")
+        self.assertEqual(db.tl_override_for_offset(1).jp_text, "二行目")
+        self.assertEqual(db.get_charswap_map(), {'é': '@'})
+
+    def test_torn_record_followed_by_appends(self):
+        db = TranslationDb.from_file(self.path, write_through=True)
+        db.set_translation_and_comment_for_hash(self.hashes[0], "one", None)
+        db.close()
+
+        # Crash in the middle of writing a record
+        with open(self.journal_path, 'ab') as f:
+            f.write(b'{"op": "line", "jp_ha')
+
+        db = TranslationDb.from_file(self.path, write_through=True)
+        db.set_translation_and_comment_for_hash(self.hashes[0], "two", None)
+        db.set_translation_and_comment_for_hash(
+            self.hashes[1], "three", None)
+        db.close()
+
+        db = TranslationDb.from_file(self.path)
+        self.assertEqual(
+            [db.tl_line_with_hash(jp_hash).en_text
+             for jp_hash in self.hashes],
+            ["two", "three"])
+
+    def test_compaction(self):
+        db = TranslationDb.from_file(self.path, write_through=True)
+        db.set_translation_and_comment_for_hash(
+            self.hashes[1], "Line two", None)
+        db.to_file(self.path)
+
+        # The snapshot now holds the edit, and the journal is empty
+        self.assertEqual(os.path.getsize(self.journal_path), 0)
+        self.assertEqual(
+            TranslationDb.from_file(self.path).tl_line_with_hash(
+                self.hashes[1]).en_text,
+            "Line two")
+
+        # Journalling continues after compaction
+        db.clear_offset_overrides()
+        db.close()
+        self.assertGreater(os.path.getsize(self.journal_path), 0)
+
+    def test_save_compacts_large_journal(self):
+        db = TranslationDb.from_file(self.path, write_through=True)
+        db.set_translation_and_comment_for_hash(
+            self.hashes[0], "x" * DbJournal.COMPACT_THRESHOLD_BYTES, None)
+        db.save(self.path)
+        db.close()
+
+        self.assertEqual(os.path.getsize(self.journal_path), 0)
+
+    def test_batch(self):
+        db = TranslationDb.from_file(self.path, write_through=True)
+        with db.edit_batch():
+            for i, jp_hash in enumerate(self.hashes):
+                db.set_translation_and_comment_for_hash(
+                    jp_hash, f"Line {i}", None)
+            self.assertFalse(os.path.exists(self.journal_path))
+        db.close()
+
+        with open(self.journal_path, 'rb') as f:
+            self.assertEqual(len(f.read().splitlines()), 2)
+
+    def test_damaged_record(self):
+        db = TranslationDb.from_file(self.path, write_through=True)
+        db.set_translation_and_comment_for_hash(
+            self.hashes[0], "Line one", None)
+        db.close()
+
+        # Simulate a crash partway through appending a record
+        with open(self.journal_path, 'ab') as f:
+            f.write(b'{"op": "line", "jp_ha')
+
+        db = TranslationDb.from_file(self.path)
+        self.assertEqual(
+            db.tl_line_with_hash(self.hashes[0]).en_text, "Line one")
+
+    def test_no_write_through(self):
+        db = TranslationDb.from_file(self.path)
+        db.set_translation_and_comment_for_hash(
+            self.hashes[0], "Line one", None)
+        self.assertFalse(os.path.exists(self.journal_path))
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+from luna.mrg_diff import MrgDiff
+from luna.mrg_parser import Mzp
+from luna.translation_db import TranslationDb
+
+
+class MrgDiffTests(unittest.TestCase):
+
+    STRINGS = {0: "zero", 1: "one", 2: "two", 3: "three"}
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def write_archive(self, name, strings):
+        path = os.path.join(self._tmpdir.name, name)
+        with open(path, 'wb') as f:
+            f.write(TranslationDb({}, {}, {}).pack_linebroken_text_to_mrg(
+                strings))
+        return path
+
+    def test_identical(self):
+        path_a = self.write_archive('a.mrg', self.STRINGS)
+        path_b = self.write_archive('b.mrg', self.STRINGS)
+        diff = MrgDiff(path_a, path_b)
+        self.assertTrue(diff.is_identical())
+        self.assertEqual(
+            MrgDiff.section_digests(path_a), MrgDiff.section_digests(path_b))
+
+    def test_changed_strings(self):
+        strings = dict(self.STRINGS)
+        strings[1] = "uno"
+        strings[3] = "three!"
+        path_a = self.write_archive('a.mrg', self.STRINGS)
+        path_b = self.write_archive('b.mrg', strings)
+        diff = MrgDiff(path_a, path_b)
+        self.assertFalse(diff.is_identical())
+        self.assertEqual(
+            [d.index for d in diff.changed_sections], [0, 1])
+        self.assertEqual(diff.changed_strings, {(0, 1): [1, 3]})
+
+    def test_other_archives_have_no_strings(self):
+        # Same layout as allscr: names, 2 unknown entries and the scripts,
+        # an even number of sections that aren't offset/string table pairs
+        names = b''.join(
+            name.ljust(32, b'\0') for name in (b'SCENE_A', b'SCENE_B'))
+        paths = []
+        for name, script in (('a.mrg', b'_PGST(1);'), ('b.mrg', b'_PGST(2);')):
+            paths.append(os.path.join(self._tmpdir.name, name))
+            with open(paths[-1], 'wb') as f:
+                f.write(Mzp.pack([names, b'', b'', script]))
+
+        diff = MrgDiff(*paths)
+        self.assertEqual([d.index for d in diff.changed_sections], [3])
+        self.assertEqual(diff.changed_strings, {})
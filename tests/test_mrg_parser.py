@@ -0,0 +1,145 @@
+import io
+import mmap
+import os
+import struct
+import tempfile
+import unittest
+
+from luna.mrg_parser import Mzp
+
+
+class MzpTests(unittest.TestCase):
+
+    SECTIONS = [b'first', b'', b'x' * 0x1234, b'last section']
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmpdir.name, 'test.mrg')
+        with open(self.path, 'wb') as f:
+            f.write(Mzp.pack(self.SECTIONS))
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_read_path(self):
+        mzp = Mzp(self.path)
+        self.assertEqual([bytes(d) for d in mzp.data], self.SECTIONS)
+
+    def test_read_buffer(self):
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        mzp = Mzp(memoryview(raw))
+        self.assertEqual([bytes(d) for d in mzp.data], self.SECTIONS)
+
+        # Entry ranges point at the section data within the archive
+        (start, size) = mzp.entry_range(2)
+        self.assertEqual(raw[start:start + size], self.SECTIONS[2])
+
+    def test_read_mmap(self):
+        with open(self.path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            mzp = Mzp(m)
+            self.assertEqual([bytes(d) for d in mzp.data], self.SECTIONS)
+            del mzp
+
+    def test_lazy_entries(self):
+        with Mzp(self.path) as mzp:
+            self.assertEqual(len(mzp.data), len(self.SECTIONS))
+            self.assertEqual(bytes(mzp.data[-1]), self.SECTIONS[-1])
+            self.assertEqual(
+                [bytes(d) for d in mzp.data[1:3]], self.SECTIONS[1:3])
+            with self.assertRaises(IndexError):
+                mzp.data[len(self.SECTIONS)]
+
+    def test_write_streaming_sections(self):
+        expect = Mzp.pack(self.SECTIONS)
+
+        # Buffers, file objects and iterables of chunks
+        sections = [
+            memoryview(self.SECTIONS[0]),
+            io.BytesIO(self.SECTIONS[1]),
+            (self.SECTIONS[2][i:i + 100]
+             for i in range(0, len(self.SECTIONS[2]), 100)),
+            self.SECTIONS[3],
+        ]
+        output = io.BytesIO()
+        Mzp.write(output, sections)
+        self.assertEqual(output.getvalue(), expect)
+
+        # Known sizes only, so the header can be written up front
+        Mzp.write(self.path, [io.BytesIO(s) for s in self.SECTIONS])
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), expect)
+
+    def test_pack_alignment(self):
+        packed = Mzp.pack([b'a', b'bc'])
+        self.assertEqual(len(packed) % 8, 0)
+        mzp = Mzp(packed)
+        self.assertEqual(mzp.entry_range(1)[0] - mzp.entry_range(0)[0], 16)
+        self.assertEqual([bytes(d) for d in mzp.data], [b'a', b'bc'])
+
+    def test_patch_resize(self):
+        sections = list(self.SECTIONS)
+        sections[1] = b'now a longer section'
+        sections[3] = b''
+        Mzp.patch(self.path, {1: sections[1], 3: sections[3]})
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), Mzp.pack(sections))
+
+    def test_patch_same_size(self):
+        sections = list(self.SECTIONS)
+        sections[2] = b'y' * len(sections[2])
+        Mzp.patch(self.path, {2: sections[2]})
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), Mzp.pack(sections))
+
+    def test_patch_keeps_leading_layout(self):
+        # Sections ahead of the first replaced one are left alone, even if
+        # they don't follow the layout write() would use
+        data = bytearray(b'\xff' * 0x60)
+        data[0x40:0x41] = b'b'
+        data[0x50:0x51] = b'c'
+        with open(self.path, 'wb') as f:
+            f.write(struct.pack("<6sH", Mzp.MAGIC, 3))
+            f.write(Mzp.EntryHeader.pack(0x00, 1))
+            f.write(Mzp.EntryHeader.pack(0x40, 1))
+            f.write(Mzp.EntryHeader.pack(0x50, 1))
+            f.write(b'a' + data[1:])
+
+        Mzp.patch(self.path, {2: b'cccc'})
+        with Mzp(self.path) as mzp:
+            self.assertEqual(mzp.entry_range(1)[0], 8 + 8 * 3 + 0x40)
+            self.assertEqual(
+                [bytes(d) for d in mzp.data], [b'a', b'b', b'cccc'])
+
+    def test_pooled_sections(self):
+        sections = [b'shared', b'other', b'shared', b'', b'']
+        packed = Mzp.pack(sections, pool=True)
+        self.assertEqual(len(packed), Mzp.packed_size(sections, pool=True))
+        self.assertLess(len(packed), Mzp.packed_size(sections))
+
+        mzp = Mzp(packed)
+        self.assertTrue(mzp.shares_data())
+        self.assertEqual(mzp.entry_range(2), mzp.entry_range(0))
+        self.assertEqual([bytes(d) for d in mzp.data], sections)
+        self.assertFalse(Mzp(Mzp.pack(sections)).shares_data())
+
+        # Any buffer can be pooled, but only with identical contents
+        sections = [memoryview(b'shared'), b'sharee', bytearray(b'shared')]
+        mzp = Mzp(Mzp.pack(sections, pool=True))
+        self.assertEqual(mzp.entry_range(2), mzp.entry_range(0))
+        self.assertNotEqual(mzp.entry_range(1), mzp.entry_range(0))
+        self.assertEqual([bytes(d) for d in mzp.data], [
+            b'shared', b'sharee', b'shared'])
+
+    def test_patch_pooled(self):
+        # Replacing one copy of a pooled section leaves the other intact
+        sections = [b'shared', b'other', b'shared']
+        with open(self.path, 'wb') as f:
+            f.write(Mzp.pack(sections, pool=True))
+
+        Mzp.patch(self.path, {2: b'replaced'})
+        with Mzp(self.path) as mzp:
+            self.assertEqual(
+                [bytes(d) for d in mzp.data],
+                [b'shared', b'other', b'replaced'])
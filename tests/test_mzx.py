@@ -0,0 +1,155 @@
+import mmap
+import os
+import random
+import struct
+import tempfile
+import unittest
+
+from luna.mzx import Mzx
+
+
+class MzxDecompressTests(unittest.TestCase):
+
+    @staticmethod
+    def random_stream(seed, cmd_count=2000):
+        # Generate a random but well-formed MZX command stream, returning
+        # the compressed blob.
+        rng = random.Random(seed)
+        body = bytearray()
+        output_len = 0
+        for _ in range(cmd_count):
+            length = rng.randrange(64)
+            cmd = rng.randrange(4)
+            # Backreferences need enough preceding data to refer to
+            if cmd == Mzx.CMD_BACKREF and output_len < 2:
+                cmd = Mzx.CMD_LITERAL
+
+            body.append((length << 2) | cmd)
+            if cmd == Mzx.CMD_BACKREF:
+                max_dist = min(output_len // 2, 256)
+                body.append(rng.randrange(max_dist))
+            elif cmd == Mzx.CMD_LITERAL:
+                body += bytes(
+                    rng.randrange(256) for _ in range(2 * (length + 1)))
+
+            output_len += 2 if cmd == Mzx.CMD_RINGBUF else 2 * (length + 1)
+
+        # Cut the final command short to exercise output truncation
+        decompressed_size = max(output_len - 3, 0)
+        return struct.pack("<4sI", b"MZX0", decompressed_size) + bytes(body)
+
+    def test_engines_byte_identical(self):
+        for seed in range(8):
+            data = self.random_stream(seed)
+            for invert in (True, False):
+                self.assertEqual(
+                    Mzx.decompress(
+                        data, invert, engine=Mzx.ENGINE_BYTESIO),
+                    Mzx.decompress(
+                        data, invert, engine=Mzx.ENGINE_BYTEARRAY),
+                )
+
+    def test_overlapping_backref(self):
+        # Literal 'ab', then copy 4 shorts from 1 short back
+        data = struct.pack("<4sI", b"MZX0", 10) + bytes([
+            (0 << 2) | Mzx.CMD_LITERAL, ord('a') ^ 0xFF, ord('b') ^ 0xFF,
+            (3 << 2) | Mzx.CMD_BACKREF, 0,
+        ])
+        self.assertEqual(Mzx.decompress(data), b"ababababab")
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            Mzx.decompress(struct.pack("<4sI", b"MZX0", 0), engine='nope')
+
+    def test_buffer_inputs(self):
+        data = MzxDecompressTests.random_stream(3)
+        expect = Mzx.decompress(data)
+        self.assertEqual(Mzx.decompress(memoryview(data)), expect)
+        self.assertEqual(Mzx.decompress(bytearray(data)), expect)
+
+        # A range of a mapped file, as used when extracting allscr scenes
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'data.bin')
+            with open(path, 'wb') as f:
+                f.write(b'padding' + data + b'trailer')
+            with open(path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, \
+                    memoryview(m) as view, \
+                    view[7:7 + len(data)] as compressed:
+                self.assertEqual(Mzx.decompress(compressed), expect)
+                self.assertEqual(
+                    b''.join(Mzx.decompress_iter(compressed)), expect)
+
+
+class MzxStreamTests(unittest.TestCase):
+
+    def test_iter_matches_decompress(self):
+        for seed in range(4):
+            data = MzxDecompressTests.random_stream(seed)
+            for chunk_size in (1, 7, 0x1000):
+                self.assertEqual(
+                    b''.join(Mzx.decompress_iter(
+                        data, chunk_size=chunk_size)),
+                    Mzx.decompress(data),
+                )
+
+    def test_decoder_bounded_chunks(self):
+        data = MzxDecompressTests.random_stream(0)
+        decoder = Mzx.Decoder()
+        decoder.feed(data)
+        output = b''
+        while not decoder.finished:
+            chunk = decoder.decode(256)
+            self.assertLessEqual(len(chunk), 256 + Mzx.MAX_CMD_OUTPUT)
+            output += chunk
+        decoder.close()
+        self.assertEqual(output, Mzx.decompress(data))
+
+    def test_truncated_stream(self):
+        data = MzxDecompressTests.random_stream(0)
+        with self.assertRaises(AssertionError):
+            b''.join(Mzx.decompress_iter(data[:len(data) // 2]))
+
+
+class MzxCompressTests(unittest.TestCase):
+
+    def assert_round_trip(self, data, invert=True):
+        compressed = Mzx.compress(data, invert)
+        self.assertEqual(Mzx.decompress(compressed, invert), data)
+        self.assertEqual(
+            Mzx.decompress(compressed, invert, engine=Mzx.ENGINE_BYTESIO),
+            data)
+
+    def test_empty(self):
+        self.assert_round_trip(b'')
+
+    def test_odd_length(self):
+        self.assert_round_trip(b'abc')
+
+    def test_runs(self):
+        # Covers RLE from the initial short as well as long runs
+        self.assert_round_trip(b'\xff' * 1000 + b'\x00' * 1001)
+        self.assert_round_trip(b'\x00' * 1000, invert=False)
+
+    def test_script_like(self):
+        rng = random.Random(0)
+        cmds = [
+            "_PGST(%d);" % (i // 10) if rng.random() < 0.1 else
+            "_ZM%05x($%06d@n);_WKST(%d);" % (
+                rng.randrange(0x100), i, rng.randrange(4))
+            for i in range(5000)
+        ]
+        data = "".join(cmds).encode('utf-8')
+        for invert in (True, False):
+            self.assert_round_trip(data, invert)
+
+        # Repetitive scripts should actually get smaller
+        self.assertLess(len(Mzx.compress(data)), len(data))
+
+    def test_random(self):
+        rng = random.Random(1)
+        for _ in range(10):
+            # Small alphabet so that all command types get exercised
+            size = rng.randrange(4000)
+            data = bytes(rng.choice(b'\x00\x01\xff') for _ in range(size))
+            self.assert_round_trip(data)
@@ -1,6 +1,15 @@
+import json
+import os
+import pickle
+import random
+import struct
+import tempfile
 import unittest
 from collections import defaultdict
 
+from luna.mrg_parser import Mzp
+from luna.mzx import Mzx
+from luna.scene_cache import SceneCache
 from luna.translation_db import TranslationDb
 
 
@@ -269,3 +278,685 @@ class LinebreakTests(unittest.TestCase):
         }
         result = db.generate_linebroken_text_map()
         self.assertEqual(result, expect)
+
+    def test_parse_chunked_script(self):
+        script = (
+            "_PGST(1);_ZMbc419($043897^$043898@n);_MSAD($014370);"
+            "_ZM0349a($001493@k@e);_ZM0349b(@x$001494);"
+        ).encode('utf-8')
+        whole = TranslationDb.parse_script_cmds(
+            script,
+            defaultdict(lambda: TranslationDb.TLLine('a jp string')),
+            defaultdict(lambda: 'a content hash')
+        )
+        chunked = TranslationDb.parse_script_cmds(
+            (script[i:i+5] for i in range(0, len(script), 5)),
+            defaultdict(lambda: TranslationDb.TLLine('a jp string')),
+            defaultdict(lambda: 'a content hash')
+        )
+        self.assertEqual(whole, chunked)
+        self.assertEqual(len(whole), 5)
+
+    def test_scan_matches_tokenizer(self):
+        script = (
+            "\r\n_PGST(1);\t_ZMbc419($043897^$043898@n);_WKST(1);"
+            "　_MSAD($014370)　;_SELR($000001@x,$000002);_PGSTX(3);"
+            "_ZM0349b(@x$001494);_VPLY(_ZM,1);not a command;_PGST(2);"
+            "_BGMP(1);_ZM0349c();\x1c_ZM0349d($００１４９５)"
+        ).encode('utf-8')
+
+        # Same as tokenizing every command and keeping the relevant ones
+        expect = []
+        for cmd in TranslationDb.split_script_cmds(script):
+            match = TranslationDb.SCRIPT_CMD_REGEX.match(cmd)
+            if not match:
+                continue
+            (opcode, arguments) = match.groups()
+            if opcode in ('PGST', 'MSAD', 'SELR') or opcode.startswith('ZM'):
+                expect.append((opcode, arguments.split(',')))
+
+        # Arguments of ASCII-only commands come back as bytes
+        for chunks in ([script], [script[i:i+7]
+                                  for i in range(0, len(script), 7)]):
+            self.assertEqual([
+                (opcode, [
+                    arg.decode('ascii') if isinstance(arg, bytes) else arg
+                    for arg in arguments
+                ])
+                for opcode, arguments in TranslationDb.scan_script_cmds(
+                    chunks)
+            ], expect)
+        self.assertEqual(len(expect), 8)
+
+
+class CompactRepresentationTests(unittest.TestCase):
+
+    def test_text_command_flags(self):
+        cmd = TranslationDb.TextCommand(
+            1, "a" * 40, 2, is_glued=True, modifiers=["@x"])
+        self.assertEqual(
+            (cmd.has_ruby, cmd.is_glued, cmd.is_choice,
+             cmd.has_forced_newline),
+            (False, True, False, False))
+        cmd.is_glued = False
+        cmd.has_forced_newline = True
+        self.assertEqual(
+            (cmd.is_glued, cmd.has_forced_newline), (False, True))
+
+        # JSON is unchanged
+        self.assertEqual(cmd.as_json(), {
+            'offset': 1,
+            'jp_hash': "a" * 40,
+            'page_number': 2,
+            'modifiers': ["@x"],
+            'has_forced_newline': True,
+        })
+        self.assertEqual(
+            TranslationDb.TextCommand.from_json(cmd.as_json()), cmd)
+
+    def test_shared_storage(self):
+        jp_hash = "".join(["b"] * 40)
+        cmd_a = TranslationDb.TextCommand(0, jp_hash, 0, modifiers=["@n"])
+        cmd_b = TranslationDb.TextCommand(
+            1, "".join(["b"] * 40), 0, modifiers=["@n"])
+        self.assertIs(cmd_a.jp_hash, cmd_b.jp_hash)
+        self.assertIs(cmd_a.modifiers, cmd_b.modifiers)
+
+        # Including for commands unpickled from worker processes
+        cmd_c = pickle.loads(pickle.dumps(TranslationDb.TextCommand(
+            2, "".join(["b"] * 40), 0, is_glued=True, modifiers=["@n"])))
+        self.assertIs(cmd_c.jp_hash, cmd_a.jp_hash)
+        self.assertIs(cmd_c.modifiers, cmd_a.modifiers)
+        self.assertTrue(cmd_c.is_glued)
+
+    def test_override_shares_jp_text(self):
+        line = TranslationDb.TLLine("行", "Line", None)
+        db = TranslationDb(
+            {'SCENE': [TranslationDb.TextCommand(
+                5, line.content_hash(), 0)]},
+            {line.content_hash(): line},
+            {}
+        )
+        db.override_translation_and_comment_for_offset(5, "Override", None)
+        override = db.tl_override_for_offset(5)
+        self.assertIs(override.jp_text, line.jp_text)
+        self.assertEqual(line.en_text, "Line")
+
+        reloaded = TranslationDb.from_json(json.loads(db.as_json()))
+        self.assertIs(
+            reloaded.tl_override_for_offset(5).jp_text,
+            reloaded.tl_line_with_hash(line.content_hash()).jp_text)
+
+
+class ProgressTests(unittest.TestCase):
+
+    def setUp(self):
+        lines = [TranslationDb.TLLine(f"行{i}") for i in range(6)]
+        self.hashes = [line.content_hash() for line in lines]
+        rng = random.Random(0)
+        offset = 0
+        scene_map = {}
+        for scene in range(4):
+            commands = []
+            for _ in range(10):
+                commands.append(TranslationDb.TextCommand(
+                    offset, rng.choice(self.hashes), 0))
+                offset += 1
+            scene_map[f"SCENE_{scene}"] = commands
+        self.offset_count = offset
+        self.db = TranslationDb(
+            scene_map, {line.content_hash(): line for line in lines}, {})
+
+    def recount(self, scene_name):
+        commands = self.db.lines_for_scene(scene_name)
+        return (
+            sum(1 for cmd in commands if self.db.tl_line_for_cmd(cmd).en_text),
+            len(commands)
+        )
+
+    def assertProgressMatches(self):
+        global_progress = self.db.translation_progress()
+        self.assertEqual(
+            (global_progress.translated, global_progress.total),
+            (
+                sum(
+                    1 for jp_hash in self.hashes
+                    if self.db.tl_line_with_hash(jp_hash).en_text
+                ),
+                len(self.hashes)
+            )
+        )
+        for scene_name in self.db.scene_names():
+            progress = self.db.translation_progress(scene_name)
+            self.assertEqual(
+                (progress.translated, progress.total),
+                self.recount(scene_name))
+
+    def test_progress_tracks_edits(self):
+        self.assertEqual(self.db.translated_percent(), 0.0)
+        self.assertProgressMatches()
+
+        rng = random.Random(1)
+        for step in range(200):
+            action = rng.randrange(10)
+            en_text = rng.choice(["", None, "Text"])
+            if action < 6:
+                self.db.set_translation_and_comment_for_hash(
+                    rng.choice(self.hashes), en_text, None)
+            elif action < 9:
+                self.db.override_translation_and_comment_for_offset(
+                    rng.randrange(self.offset_count), en_text, None)
+            else:
+                self.db.clear_offset_overrides()
+            self.assertProgressMatches()
+
+        self.assertEqual(
+            self.db.translated_percent(),
+            self.db.translation_progress().percent())
+
+    def test_override_shared_offset(self):
+        # S2 shows the same line (offset) as S1, plus one of its own
+        lines = [TranslationDb.TLLine("行0"), TranslationDb.TLLine("行1")]
+        self.hashes = [line.content_hash() for line in lines]
+        (hash_0, hash_1) = self.hashes
+        self.db = TranslationDb(
+            {
+                'S1': [TranslationDb.TextCommand(0, hash_0, 0)],
+                'S2': [
+                    TranslationDb.TextCommand(0, hash_0, 0),
+                    TranslationDb.TextCommand(1, hash_1, 0),
+                ],
+            },
+            {line.content_hash(): line for line in lines},
+            {}
+        )
+        self.assertProgressMatches()
+
+        self.db.override_translation_and_comment_for_offset(0, "Text", None)
+        progress = self.db.translation_progress('S2')
+        self.assertEqual((progress.translated, progress.total), (1, 2))
+        self.assertProgressMatches()
+
+
+class IncrementalRenderTests(unittest.TestCase):
+
+    def setUp(self):
+        lines = [TranslationDb.TLLine(f"行{i}\r\n") for i in range(8)]
+        self.hashes = [line.content_hash() for line in lines]
+        rng = random.Random(2)
+        offset = 0
+        scene_map = {}
+        for scene in range(5):
+            commands = []
+            for _ in range(12):
+                commands.append(TranslationDb.TextCommand(
+                    offset, rng.choice(self.hashes), offset // 4,
+                    is_glued=rng.random() < 0.3))
+                offset += 1
+            scene_map[f"SCENE_{scene}"] = commands
+        self.db = TranslationDb(
+            scene_map, {line.content_hash(): line for line in lines}, {})
+        for i, jp_hash in enumerate(self.hashes):
+            self.db.set_translation_and_comment_for_hash(
+                jp_hash, " ".join(["word"] * (i * 5 + 1)), None)
+
+    def full_render(self):
+        fresh = TranslationDb.from_json(json.loads(self.db.as_json()))
+        return fresh.generate_linebroken_text_map()
+
+    def test_only_affected_scenes_are_dirty(self):
+        self.assertEqual(
+            self.db.generate_linebroken_text_map(), self.full_render())
+        self.assertEqual(self.db.dirty_scenes(), [])
+
+        # Editing a line dirties exactly the scenes that use it
+        self.db.set_translation_and_comment_for_hash(
+            self.hashes[3], "Edited", None)
+        self.assertEqual(
+            self.db.dirty_scenes(), self.db.scenes_for_hash(self.hashes[3]))
+        self.assertEqual(
+            self.db.generate_linebroken_text_map(), self.full_render())
+
+        # As does an override
+        self.db.override_translation_and_comment_for_offset(
+            13, "Override", None)
+        self.assertEqual(self.db.dirty_scenes(), ['SCENE_1'])
+        self.assertEqual(
+            self.db.generate_linebroken_text_map(), self.full_render())
+
+        self.db.clear_offset_overrides()
+        self.assertEqual(self.db.dirty_scenes(), ['SCENE_1'])
+        self.assertEqual(
+            self.db.generate_linebroken_text_map(), self.full_render())
+
+        # Changing render settings re-renders everything
+        self.db.set_charswap_map({'o': '0'})
+        self.assertEqual(
+            len(self.db.dirty_scenes()), len(self.db.scene_names()))
+        self.assertIn(
+            '0', ''.join(self.db.generate_linebroken_text_map(
+                perform_charswap=True).values()))
+
+    def test_force_full(self):
+        rendered = self.db.generate_linebroken_text_map()
+        self.assertEqual(
+            self.db.generate_linebroken_text_map(force_full=True), rendered)
+
+
+class IncrementalInjectTests(IncrementalRenderTests):
+
+    def setUp(self):
+        super().setUp()
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmpdir.name, 'script_text.mrg')
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def reload(self):
+        # Fresh DB, as for a new run of the inject
+        return TranslationDb.from_json(json.loads(self.db.as_json()))
+
+    def assertInjected(self, db):
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), db.generate_script_text_mrg())
+
+    def test_only_changed_scenes_are_rendered(self):
+        db = self.reload()
+        self.assertEqual(
+            db.inject_incremental(self.path), db.scene_names(True))
+        self.assertInjected(self.reload())
+
+        # Nothing changed, so nothing is rendered or written
+        mtime = os.stat(self.path).st_mtime_ns
+        self.assertEqual(self.reload().inject_incremental(self.path), [])
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+        self.db.set_translation_and_comment_for_hash(
+            self.hashes[3], "A changed line", None)
+        db = self.reload()
+        self.assertEqual(db.inject_incremental(self.path), [
+            scene_name for scene_name in db.scene_names(True)
+            if any(cmd.jp_hash == self.hashes[3]
+                   for cmd in db.lines_for_scene(scene_name))
+        ])
+        self.assertInjected(self.reload())
+
+    def test_modified_output_is_rendered_in_full(self):
+        self.reload().inject_incremental(self.path)
+        with open(self.path, 'wb') as f:
+            f.write(TranslationDb({}, {}, {}).pack_linebroken_text_to_mrg(
+                {0: "Something else"}))
+
+        db = self.reload()
+        self.assertEqual(
+            db.inject_incremental(self.path), db.scene_names(True))
+        self.assertInjected(self.reload())
+
+    def test_damaged_output_is_rewritten(self):
+        # As left behind by an interrupted write, or something else entirely
+        for contents in (b"", b"mrgd00\x05\x00", b"Not an MZP at all"):
+            with open(self.path, 'wb') as f:
+                f.write(contents)
+
+            db = self.reload()
+            self.assertEqual(
+                db.inject_incremental(self.path), db.scene_names(True))
+            self.assertInjected(self.reload())
+
+
+class LineRenderCacheTests(unittest.TestCase):
+
+    def test_cache_matches_uncached(self):
+        rng = random.Random(4)
+        texts = ["Ah!", "Hm.", "A much longer line " * 4, " and glued on."]
+        lines = {}
+        scene_map = {}
+        offset = 0
+        for scene in range(4):
+            commands = []
+            for _ in range(25):
+                line = TranslationDb.TLLine(f"jp{offset}", rng.choice(texts))
+                lines[line.content_hash()] = line
+                commands.append(TranslationDb.TextCommand(
+                    offset, line.content_hash(), offset // 5,
+                    is_glued=rng.random() < 0.4))
+                offset += 1
+            scene_map[f"SCENE_{scene}"] = commands
+
+        cached_db = TranslationDb(scene_map, lines, {})
+        uncached_db = TranslationDb(scene_map, lines, {})
+        uncached_db._line_render_cache = TranslationDb.LineRenderCache(0)
+
+        self.assertEqual(
+            cached_db.generate_linebroken_text_map(),
+            uncached_db.generate_linebroken_text_map())
+
+        cache = cached_db.line_render_cache()
+        self.assertEqual(cache.hits + cache.misses, 100)
+        self.assertGreater(cache.hit_rate(), 0.5)
+
+    def test_lru_eviction(self):
+        cache = TranslationDb.LineRenderCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+
+class ParallelRenderTests(unittest.TestCase):
+
+    def make_db(self, scene_texts):
+        # scene_texts: scene name -> list of (en_text, is_glued)
+        line_by_hash = {}
+        scene_map = {}
+        offset = 0
+        for scene_name, texts in scene_texts.items():
+            commands = []
+            for en_text, is_glued in texts:
+                line = TranslationDb.TLLine(f"jp{offset}\r\n", en_text)
+                line_by_hash[line.content_hash()] = line
+                commands.append(TranslationDb.TextCommand(
+                    offset, line.content_hash(), 0, is_glued=is_glued))
+                offset += 1
+            scene_map[scene_name] = commands
+        return TranslationDb(scene_map, line_by_hash, {})
+
+    def test_parallel_matches_serial(self):
+        rng = random.Random(3)
+        scene_texts = {
+            f"SCENE_{scene}": [
+                (
+                    " ".join(["word"] * rng.randrange(1, 30)),
+                    rng.random() < 0.3
+                )
+                for _ in range(20)
+            ]
+            for scene in range(8)
+        }
+        serial_db = self.make_db(scene_texts)
+        parallel_db = self.make_db(scene_texts)
+        parallel_db.override_translation_and_comment_for_offset(
+            5, "Overridden", None)
+        serial_db.override_translation_and_comment_for_offset(
+            5, "Overridden", None)
+
+        self.assertEqual(
+            parallel_db.generate_script_text_mrg(jobs=4),
+            serial_db.generate_script_text_mrg(jobs=1))
+
+    def test_first_error_reports_scene(self):
+        unbreakable = [
+            (
+                "\"Tsk, can't you last even two minutes, you weakling... "
+                "I guess we've no choice but to talk it out now.",
+                False
+            ),
+            ("―――", True),
+            ("Oi, get back Noel! You'll break your damn neck!\"", True),
+        ]
+        db = self.make_db({
+            'SCENE_OK': [("Fine.", False)],
+            'SCENE_BAD_1': unbreakable,
+            'SCENE_BAD_2': unbreakable,
+        })
+        for jobs in (1, 3):
+            with self.assertRaises(TranslationDb.SceneRenderError) as ctx:
+                db.generate_linebroken_text_map(force_full=True, jobs=jobs)
+            self.assertEqual(ctx.exception.scene_name, 'SCENE_BAD_1')
+            self.assertIn('SCENE_BAD_1', str(ctx.exception))
+            self.assertIsInstance(ctx.exception, RuntimeError)
+
+    def test_check_render_collects_every_problem(self):
+        unbreakable = [
+            (
+                "\"Tsk, can't you last even two minutes, you weakling... "
+                "I guess we've no choice but to talk it out now.",
+                False
+            ),
+            ("―――", True),
+            ("Oi, get back Noel! You'll break your damn neck!\"", True),
+        ]
+        db = self.make_db({
+            'SCENE_OK': [("Fine.", False)],
+            'SCENE_BAD_1': unbreakable,
+            'SCENE_BAD_2': [("Bad >ruby", False), ("%{bogus}", False)],
+            'SCENE_BAD_3': unbreakable,
+        })
+
+        for jobs in (1, 3):
+            db.invalidate_rendered_scenes()
+            problems = db.check_render(jobs=jobs)
+            self.assertEqual(
+                [(p.scene_name, p.offset) for p in problems],
+                [('SCENE_BAD_1', 2), ('SCENE_BAD_2', 4), ('SCENE_BAD_2', 5),
+                 ('SCENE_BAD_3', 7)])
+            self.assertEqual(
+                problems[0].jp_hash, db.command_for_offset(2)[2].jp_hash)
+            self.assertIn("backtracking", problems[0].message)
+            self.assertIn("ruby-end", problems[1].message)
+
+            # Only the scene that rendered cleanly is kept
+            self.assertEqual(
+                db.dirty_scenes(),
+                ['SCENE_BAD_1', 'SCENE_BAD_2', 'SCENE_BAD_3'])
+
+
+class PackTests(unittest.TestCase):
+
+    @staticmethod
+    def reference_sections(offset_to_string):
+        # Straightforward per-offset packing of the script text tables
+        def tables(strings):
+            offset_table = b''
+            string_table = b''
+            for string in strings:
+                offset_table += struct.pack(">I", len(string_table))
+                string_table += string.encode('utf-8')
+            offset_table += struct.pack(
+                ">III", len(string_table), len(string_table), 0xFFFFFFFF)
+            return [offset_table, string_table]
+
+        max_offset = max(offset_to_string.keys())
+        strings = [
+            offset_to_string.get(offset, '')
+            for offset in range(max_offset + 1)
+        ]
+        return (
+            tables([string for string in strings if string]) +
+            tables(["  \r\n"] * (max_offset + 1)) +
+            tables(["\u3000\r\n"] * (max_offset + 1)) * 3
+        )
+
+    def test_sections_match_reference(self):
+        offset_to_string = {
+            0: "First line\r\n",
+            1: "<二|に>行目",
+            2: "",
+            4: "Skipped offset 3 before this\n",
+            5: "Last",
+        }
+        db = TranslationDb({}, {}, {})
+        self.assertEqual(
+            db.linebroken_text_sections(offset_to_string),
+            self.reference_sections(offset_to_string))
+
+        # Again, with the padding tables cached
+        offset_to_string[5] = "Changed"
+        self.assertEqual(
+            db.linebroken_text_sections(offset_to_string),
+            self.reference_sections(offset_to_string))
+
+
+class FromMrgTests(unittest.TestCase):
+
+    STRINGS = {
+        0: "一行目\r\n",
+        1: "<二|に>行目",
+        2: "三行目",
+        3: "一行目\r\n",
+        4: "使われない行",
+    }
+    SCRIPTS = {
+        'SCENE_A': "_PGST(1);_ZM00001($000000^$000001@n);_MSAD($000002);",
+        'SCENE_B': "_PGST(4);_SELR($000003@x);_WKST(1);",
+    }
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.script_text_path = os.path.join(
+            self._tmpdir.name, 'script_text.mrg')
+        self.allscr_path = os.path.join(self._tmpdir.name, 'allscr.mrg')
+
+        # Script text archive
+        with open(self.script_text_path, 'wb') as f:
+            f.write(TranslationDb({}, {}, {}).pack_linebroken_text_to_mrg(
+                self.STRINGS))
+
+        # allscr archive: scene names, 2 unknown entries, compressed scripts
+        scene_names = b''.join(
+            name.encode('utf-8').ljust(32, b'\0') for name in self.SCRIPTS)
+        with open(self.allscr_path, 'wb') as f:
+            f.write(Mzp.pack([scene_names, b'', b''] + [
+                Mzx.compress(script.encode('utf-8'))
+                for script in self.SCRIPTS.values()
+            ]))
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_from_mrg(self):
+        db = TranslationDb.from_mrg(
+            self.allscr_path, self.script_text_path, jobs=1)
+        self.assertEqual(
+            db.scene_names(), ['SCENE_A', 'SCENE_B', 'ORPHANED_LINES'])
+
+        scene_a = db.lines_for_scene('SCENE_A')
+        self.assertEqual([cmd.offset for cmd in scene_a], [0, 1, 2])
+        self.assertTrue(scene_a[0].has_forced_newline)
+        self.assertTrue(scene_a[1].has_ruby)
+        self.assertTrue(scene_a[2].is_glued)
+
+        scene_b = db.lines_for_scene('SCENE_B')
+        self.assertEqual(scene_b[0].page_number, 4)
+        self.assertTrue(scene_b[0].is_choice)
+        self.assertEqual(scene_b[0].jp_hash, scene_a[0].jp_hash)
+
+        orphans = db.lines_for_scene('ORPHANED_LINES')
+        self.assertEqual([cmd.offset for cmd in orphans], [4])
+        self.assertEqual(
+            db.tl_line_with_hash(orphans[0].jp_hash).jp_text,
+            self.STRINGS[4])
+
+    def test_from_mrg_parallel(self):
+        serial = TranslationDb.from_mrg(
+            self.allscr_path, self.script_text_path, jobs=1)
+        parallel = TranslationDb.from_mrg(
+            self.allscr_path, self.script_text_path, jobs=2)
+        self.assertEqual(serial.as_json(), parallel.as_json())
+
+    def test_from_mrg_cache(self):
+        cache_dir = os.path.join(self._tmpdir.name, 'cache')
+        uncached = TranslationDb.from_mrg(
+            self.allscr_path, self.script_text_path, jobs=1)
+
+        # First run populates the cache, second run reads it back
+        cache = SceneCache(cache_dir)
+        TranslationDb.from_mrg(
+            self.allscr_path, self.script_text_path, jobs=1, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+        cache = SceneCache(cache_dir)
+        cached = TranslationDb.from_mrg(
+            self.allscr_path, self.script_text_path, jobs=1, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+        for scene in uncached.scene_names():
+            self.assertEqual(
+                uncached.lines_for_scene(scene),
+                cached.lines_for_scene(scene))
+
+    def test_scene_cache_eviction(self):
+        cache = SceneCache(
+            os.path.join(self._tmpdir.name, 'cache'), max_bytes=100)
+        cache.put('old', ['x' * 60])
+        cache.put('new', ['y' * 60])
+        os.utime(cache._entry_path('old'), (0, 0))
+        cache.evict()
+        self.assertIsNone(cache.get('old'))
+        self.assertIsNotNone(cache.get('new'))
+
+    def test_command_for_offset(self):
+        db = TranslationDb.from_mrg(
+            self.allscr_path, self.script_text_path, jobs=1)
+        for scene_name in db.scene_names(include_empty=True):
+            for i, cmd in enumerate(db.lines_for_scene(scene_name)):
+                self.assertEqual(
+                    db.command_for_offset(cmd.offset), (scene_name, i, cmd))
+                self.assertEqual(
+                    db.tl_line_for_offset(cmd.offset), cmd.jp_hash)
+
+        self.assertIsNone(db.command_for_offset(len(self.STRINGS) + 10))
+        self.assertIsNone(db.tl_line_for_offset(len(self.STRINGS) + 10))
+
+    def test_commands_for_hash(self):
+        db = TranslationDb.from_mrg(
+            self.allscr_path, self.script_text_path, jobs=1)
+
+        # Strings 0 and 3 are identical, so share a hash
+        shared_hash = db.tl_line_for_offset(0)
+        self.assertEqual(
+            [cmd.offset for cmd in db.commands_for_hash(shared_hash)], [0, 3])
+        self.assertEqual(db.usage_count(shared_hash), 2)
+        self.assertEqual(
+            db.scenes_for_hash(shared_hash), ['SCENE_A', 'SCENE_B'])
+
+        orphan_hash = db.tl_line_for_offset(4)
+        self.assertEqual(db.scenes_for_hash(orphan_hash), ['ORPHANED_LINES'])
+
+        self.assertEqual(db.commands_for_hash('missing'), [])
+        self.assertEqual(db.usage_count('missing'), 0)
+        self.assertEqual(db.scenes_for_hash('missing'), [])
+
+    def test_patch_script_text_mrg(self):
+        db = TranslationDb.from_mrg(
+            self.allscr_path, self.script_text_path, jobs=1)
+        db.set_translation_and_comment_for_hash(
+            db.lines_for_scene('SCENE_A')[2].jp_hash, "Line three", None)
+
+        # Only the translation offset/string tables change
+        changed = db.patch_script_text_mrg(self.script_text_path)
+        self.assertEqual(changed, [0, 1])
+        with open(self.script_text_path, 'rb') as f:
+            self.assertEqual(f.read(), db.generate_script_text_mrg())
+
+        # Nothing left to change second time around
+        self.assertEqual(db.patch_script_text_mrg(self.script_text_path), [])
+
+    def test_pooled_script_text_mrg(self):
+        db = TranslationDb.from_mrg(
+            self.allscr_path, self.script_text_path, jobs=1)
+        offset_to_string = db.generate_linebroken_text_map()
+
+        # The repeated padding tables are only stored once
+        pooled = db.pack_linebroken_text_to_mrg(offset_to_string, pool=True)
+        self.assertLess(
+            len(pooled), len(db.pack_linebroken_text_to_mrg(offset_to_string)))
+        self.assertEqual(
+            db.verify_script_text_mrg(pooled, offset_to_string), [])
+
+        # Reading it back gives the same DB
+        with open(self.script_text_path, 'wb') as f:
+            f.write(pooled)
+        pooled_db = TranslationDb.from_mrg(
+            self.allscr_path, self.script_text_path, jobs=1)
+        self.assertEqual(pooled_db.as_json(), db.as_json())
+
+        # Any difference is reported
+        offset_to_string[1] = "Something else"
+        self.assertEqual(
+            db.verify_script_text_mrg(pooled, offset_to_string),
+            ["Offset 1: expected 'Something else', found "
+             f"{db.generate_linebroken_text_map()[1]!r}"])